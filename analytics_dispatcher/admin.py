@@ -1,26 +1,130 @@
+import json
+
+from django.conf import settings
 from django.contrib import admin
-from django_admin_listfilter_dropdown.filters import DropdownFilter
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils.functional import cached_property
+from django_admin_listfilter_dropdown.filters import SimpleDropdownFilter
+
+from .models import DESTINATIONS, ERRORS_Q, PENDING_Q, DeliveryError, EventToDispatch, errors_q, pending_q
+
+SUMMARY_CACHE_KEY = 'analytics_dispatcher:queue_summary'
+SEARCH_USERS_LIMIT = 1000
+
+
+def estimate_count(queryset):
+    """
+    Row count estimated by the PostgreSQL planner, None for other databases.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        limit = getattr(settings, 'DAD_ADMIN_EXACT_COUNT_LIMIT', 10000)
+        estimate = estimate_count(self.object_list)
+        if estimate is None or estimate < limit:
+            return self.object_list.count()
+        return estimate
+
+
+class EventTypeFilter(SimpleDropdownFilter):
+    title = 'event type'
+    parameter_name = 'event_type'
+
+    def lookups(self, request, model_admin):
+        # configured types instead of SELECT DISTINCT over the whole table
+        return [(name, name) for name in sorted({et.name for et in getattr(settings, 'EVENT_TYPES', [])})]
+
+    def queryset(self, request, queryset):
+        if self.value() is not None:
+            return queryset.filter(event_type=self.value())
+        return queryset
 
-from .models import EventToDispatch
+
+class DeliveryStateFilter(admin.SimpleListFilter):
+    title = 'delivery'
+    parameter_name = 'delivery'
+
+    def lookups(self, request, model_admin):
+        return [
+            ('pending', 'Pending'),
+            ('errors', 'Has errors'),
+        ] + [
+            (f'pending_{destination}', f'Pending {destination}') for destination in DESTINATIONS
+        ] + [
+            (f'errors_{destination}', f'Errors {destination}') for destination in DESTINATIONS
+        ]
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value == 'pending':
+            return queryset.filter(PENDING_Q)
+        if value == 'errors':
+            return queryset.filter(ERRORS_Q)
+        for destination in DESTINATIONS:
+            if value == f'pending_{destination}':
+                return queryset.filter(pending_q(destination))
+            if value == f'errors_{destination}':
+                return queryset.filter(errors_q(destination))
+        return queryset
+
+
+def queue_summary():
+    summary = cache.get(SUMMARY_CACHE_KEY)
+    if summary is not None:
+        return summary
+    summary = []
+    for destination in DESTINATIONS:
+        pending = EventToDispatch.objects.filter(pending_q(destination))
+        oldest = pending.order_by('timestamp').values_list('timestamp', flat=True).first()
+        summary.append({
+            'destination': destination,
+            'pending': pending.count(),
+            'oldest_pending': oldest,
+            'errors': EventToDispatch.objects.filter(errors_q(destination)).count(),
+        })
+    cache.set(SUMMARY_CACHE_KEY, summary, getattr(settings, 'DAD_ADMIN_SUMMARY_TIMEOUT', 60))
+    return summary
 
 
 @admin.register(EventToDispatch)
 class EventAdmin(admin.ModelAdmin):
-    list_display = ('f_timestamp', 'user', 'event_type',
+    list_display = ('f_timestamp', 'f_user', 'event_type',
                     'event_properties', 'user_properties',
-                    'fsent_amplitude', 'fsent_intercom', 'fsent_user_dot_com', 'fsent_ga4', 'has_errors')
+                    'fsent_amplitude', 'fsent_intercom', 'fsent_user_dot_com', 'fsent_ga4')
     list_filter = (
-        ('event_type', DropdownFilter),
+        EventTypeFilter,
+        DeliveryStateFilter,
     )
-    search_fields = ['user__email', 'user__first_name', 'user__last_name', 'event_type']
-    list_select_related = ['user']
-    readonly_fields = ['user', 'timestamp', 'event_type']
+    # users are not joined, the queue may be in another database (DAD_DATABASE)
+    search_fields = ['user_snapshot__email', 'user_snapshot__first_name', 'user_snapshot__last_name', 'event_type']
+    search_help_text = 'Event id, user email (contains "@") or event type'
+    readonly_fields = ['user', 'timestamp', 'event_type', 'session']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     fieldsets = (
         (None, {
             'fields': ('user', 'event_type', 'timestamp', 'send_amplitude', 'send_intercom', 'send_ga4')
         }),
         ('Event info', {
-            'fields': ('session_data', 'user_properties', 'event_properties')
+            'fields': ('session', 'session_data', 'user_properties', 'event_properties')
         }),
         ('Emit info', {
             'fields': ('sent_amplitude', 'status_amplitude',
@@ -31,21 +135,52 @@ class EventAdmin(admin.ModelAdmin):
         }),
     )
 
-    def has_errors(self, obj):
-        status_intercom = obj.status_intercom
-        status_amplitude = obj.status_amplitude
-        if ((status_intercom is not None and status_intercom != 'ok')
-                or (status_amplitude is not None and status_amplitude != 'ok')):
-            return 'has errors'
-        return '-'
+    def get_search_results(self, request, queryset, search_term):
+        """
+        DAD_ADMIN_SEARCH_MODE: 'prefix' (default) and 'exact' use indexes, 'contains' is the slow
+        case-insensitive search over `search_fields`. User emails are matched case-insensitively,
+        see README for the index it needs.
+        """
+        mode = getattr(settings, 'DAD_ADMIN_SEARCH_MODE', 'prefix')
+        if mode == 'contains':
+            return super().get_search_results(request, queryset, search_term)
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(pk=int(search_term)), False
+        lookup = 'exact' if mode == 'exact' else 'startswith'
+        if '@' in search_term:
+            user_ids = (get_user_model()._default_manager.filter(**{'email__i' + lookup: search_term})
+                        .values_list('pk', flat=True)[:SEARCH_USERS_LIMIT])
+            return queryset.filter(user_id__in=list(user_ids)), False
+        return queryset.filter(Q(**{'event_type__' + lookup: search_term})), False
 
-    has_errors.short_description = 'Has errors'
+    def get_urls(self):
+        return [
+            path('queue-summary/', self.admin_site.admin_view(self.queue_summary_view),
+                 name='analytics_dispatcher_eventtodispatch_queue_summary'),
+        ] + super().get_urls()
+
+    def queue_summary_view(self, request):
+        context = dict(
+            self.admin_site.each_context(request),
+            title='Event queue summary',
+            opts=self.model._meta,
+            summary=queue_summary(),
+        )
+        return TemplateResponse(request, 'admin/analytics_dispatcher/queue_summary.html', context)
 
     def f_timestamp(self, obj):
         return obj.timestamp.strftime('%Y-%m-%d %H:%M')
 
     f_timestamp.short_description = 'Timestamp'
 
+    def f_user(self, obj):
+        return obj.get_user() or ''
+
+    f_user.short_description = 'User'
+
     def fsent_amplitude(self, obj):
         if obj.sent_amplitude is not None:
             return obj.sent_amplitude.strftime('%Y-%m-%d %H:%M')
@@ -73,3 +208,13 @@ class EventAdmin(admin.ModelAdmin):
         return ''
 
     fsent_ga4.short_description = 'Sent Google Analytics 4'
+
+
+@admin.register(DeliveryError)
+class DeliveryErrorAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'event_id', 'destination', 'status', 'message')
+    list_filter = ('destination', 'status')
+    search_fields = ['=event__id']
+    readonly_fields = ['event', 'destination', 'status', 'message', 'created_at']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
@@ -0,0 +1,99 @@
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # events per batch
+    'min': 10,
+    'max': 2000,
+    'initial': 500,
+    # seconds, batches taking longer are shrunk
+    'target_latency': 30.0,
+    # seconds spent on a destination per run, `catchup_time_budget` is used while backlog exceeds `max`
+    'time_budget': 30.0,
+    'catchup_time_budget': 120.0,
+}
+
+DESTINATION_DEFAULTS = {
+    'amplitude': {'max': 1000, 'initial': 100, 'target_latency': 5.0},
+    # a fan-out batch is bounded by its slowest destination
+    'fanout': {'max': 1000, 'initial': 100},
+}
+
+
+class BatchStats:
+    """
+    Outcome of a `process_batch` call reported by a backend.
+    """
+    __slots__ = ('paused', 'errors', 'skipped')
+
+    def __init__(self):
+        self.paused = False
+        self.errors = 0
+        # processed events closed without a request to the destination (USER_MISSING, EXPIRED)
+        self.skipped = 0
+
+
+class BatchController:
+    """
+    Adapts batch size of a destination: grows it while batches are full and fast, halves it on throttling
+    or failures, shrinks it when batches get slow or error rate is high.
+    """
+    GROW = 1.5
+    CATCHUP_GROW = 2.0
+    SHRINK = 0.75
+    MAX_ERROR_RATE = 0.1
+
+    def __init__(self, destination: str, config: dict):
+        self.destination = destination
+        self.min_size = config['min']
+        self.max_size = config['max']
+        self.target_latency = config['target_latency']
+        self.time_budget = config['time_budget']
+        self.catchup_time_budget = config['catchup_time_budget']
+        self.size = max(self.min_size, min(self.max_size, config['initial']))
+        self.catching_up = False
+
+    def start_run(self, backlog: int) -> float:
+        """
+        Set mode by backlog measured up to `max_size` events, return time budget of the run.
+        """
+        self.catching_up = backlog >= self.max_size
+        return self.catchup_time_budget if self.catching_up else self.time_budget
+
+    def _resize(self, size: float):
+        new_size = max(self.min_size, min(self.max_size, int(size)))
+        if new_size != self.size:
+            logger.debug('%s batch size %d -> %d', self.destination, self.size, new_size)
+        self.size = new_size
+
+    def record(self, number: int, events_count: int, duration: float, stats: BatchStats):
+        if stats.paused:
+            self._resize(self.size / 2)
+        elif events_count > 0 and stats.errors > events_count * self.MAX_ERROR_RATE:
+            self._resize(self.size * self.SHRINK)
+        elif duration > self.target_latency:
+            self._resize(self.size * self.SHRINK)
+        elif events_count >= number:
+            self._resize(max(self.size + 1, self.size * (self.CATCHUP_GROW if self.catching_up else self.GROW)))
+
+    def record_failure(self):
+        self._resize(self.size / 2)
+
+
+_controllers = {}
+
+
+def get_controller(destination: str) -> BatchController:
+    """
+    Per process controller of a destination, bounds are set by DAD_BATCHING = {'<destination>': {...}}.
+    """
+    controller = _controllers.get(destination)
+    if controller is None:
+        config = dict(DEFAULTS)
+        config.update(DESTINATION_DEFAULTS.get(destination, {}))
+        config.update(getattr(settings, 'DAD_BATCHING', {}).get(destination, {}))
+        controller = _controllers[destination] = BatchController(destination, config)
+    return controller
@@ -0,0 +1,102 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # consecutive failed runs which open the circuit, 0 disables the breaker
+    'failure_threshold': 5,
+    # seconds the circuit stays open before a probe is allowed
+    'reset_timeout': 60,
+}
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker:
+    """
+    Per destination circuit breaker kept in Django cache, so all dispatcher processes share it.
+
+    Closed: events are dispatched, failures are counted. Open: the destination is skipped until `reset_timeout`
+    passes. Half-open: one worker sends a single probe event, success closes the circuit, failure opens it again.
+    A paused (throttled) run counts as a failure.
+    """
+
+    def __init__(self, destination: str, config: dict):
+        self.destination = destination
+        self.failure_threshold = config['failure_threshold']
+        self.reset_timeout = config['reset_timeout']
+        self._failures_key = f'analytics_dispatcher:circuit:{destination}:failures'
+        self._open_until_key = f'analytics_dispatcher:circuit:{destination}:open_until'
+        self._probe_key = f'analytics_dispatcher:circuit:{destination}:probe'
+
+    @property
+    def enabled(self) -> bool:
+        return self.failure_threshold > 0
+
+    def state(self) -> str:
+        if not self.enabled:
+            return CLOSED
+        open_until = cache.get(self._open_until_key)
+        if open_until is None:
+            return CLOSED
+        if time.time() < open_until:
+            return OPEN
+        return HALF_OPEN
+
+    def acquire(self) -> str:
+        """
+        Return the state for this run: CLOSED - dispatch normally, HALF_OPEN - send a single probe event,
+        OPEN - skip the destination. Only one worker gets HALF_OPEN per probe.
+        """
+        state = self.state()
+        if state == HALF_OPEN and not cache.add(self._probe_key, 1, self.reset_timeout):
+            return OPEN
+        return state
+
+    def record_success(self):
+        if not self.enabled:
+            return
+        if cache.get(self._open_until_key) is not None:
+            logger.info('%s circuit closed', self.destination)
+        cache.delete_many([self._failures_key, self._open_until_key, self._probe_key])
+
+    def release_probe(self):
+        """
+        Let another worker probe, when this one had no event to send.
+        """
+        cache.delete(self._probe_key)
+
+    def record_failure(self):
+        if not self.enabled:
+            return
+        if cache.get(self._open_until_key) is not None:
+            self._open()
+            return
+        cache.add(self._failures_key, 0, None)
+        try:
+            failures = cache.incr(self._failures_key)
+        except ValueError:
+            failures = 1
+            cache.set(self._failures_key, failures, None)
+        if failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        logger.warning('%s circuit opened for %d seconds', self.destination, self.reset_timeout)
+        cache.set(self._open_until_key, time.time() + self.reset_timeout, None)
+        cache.delete(self._probe_key)
+
+
+def get_breaker(destination: str) -> CircuitBreaker:
+    """
+    Breaker of a destination, configured by DAD_CIRCUIT_BREAKER = {'<destination>': {...}}.
+    """
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'DAD_CIRCUIT_BREAKER', {}).get(destination, {}))
+    return CircuitBreaker(destination, config)
@@ -1,55 +1,130 @@
 import logging
+import typing as t
 
 from django.conf import settings
-from django.db import transaction
 from django.utils.timezone import now
 
-from analytics_dispatcher import models
+from analytics_dispatcher import batching, leasing, models, profiling, sharding
 
 logger = logging.getLogger(__name__)
 
 
+class DestinationUnavailable(Exception):
+    """
+    Destination failed to accept a request (server error), the event stays pending.
+    """
+
+
+def set_status(event: models.EventToDispatch, destination: str, status: int, message: str = ''):
+    """
+    Set `sent_`/`status_` fields of a delivered event without saving, a failure with a `message` is logged
+    to `DeliveryError`. Skips without a message (USER_MISSING) are only kept in the status code.
+    """
+    setattr(event, 'sent_' + destination, now())
+    setattr(event, 'status_' + destination, status)
+    if status != models.DeliveryStatus.OK and message:
+        models.DeliveryError.objects.create(event_id=event.pk, destination=destination, status=status,
+                                           message=message)
+
+
+def set_statuses(events: t.List[models.EventToDispatch], destination: str, status: int, message: str = ''):
+    sent_time = now()
+    for event in events:
+        setattr(event, 'sent_' + destination, sent_time)
+        setattr(event, 'status_' + destination, status)
+    if status != models.DeliveryStatus.OK and message:
+        models.DeliveryError.objects.bulk_create([
+            models.DeliveryError(event_id=event.pk, destination=destination, status=status, message=message)
+            for event in events
+        ])
+
+
+def is_error(event: models.EventToDispatch, destination: str) -> bool:
+    """
+    The destination failed the event. Events skipped without a request (USER_MISSING, EXPIRED) are not errors,
+    they don't tell anything about the destination.
+    """
+    return getattr(event, 'status_' + destination) in models.ERROR_STATUSES
+
+
+def is_skipped(event: models.EventToDispatch, destination: str) -> bool:
+    """
+    The event was closed without a request to the destination.
+    """
+    return getattr(event, 'status_' + destination) in (models.DeliveryStatus.USER_MISSING,
+                                                        models.DeliveryStatus.EXPIRED,
+                                                        models.DeliveryStatus.DISABLED)
+
+
+def pending_events(service_name: str, shard: t.Optional[t.Tuple[int, int]] = None):
+    queryset = models.EventToDispatch.objects.filter(models.pending_q(service_name))
+    if shard is not None:
+        queryset = sharding.filter_shard(queryset, shard)
+    return queryset
+
+
 class AnalyticsBackend:
     SERVICE_NAME = None
     SECRET_SETTINGS_NAME = None
 
-    def is_enabled(self):
-        return hasattr(settings, self.SECRET_SETTINGS_NAME)
+    @classmethod
+    def is_enabled(cls):
+        return hasattr(settings, cls.SECRET_SETTINGS_NAME)
+
+    @classmethod
+    def status_fields(cls) -> t.Tuple[str, str]:
+        return 'sent_' + cls.SERVICE_NAME, 'status_' + cls.SERVICE_NAME
+
+    def deliver(self, event) -> t.Optional[str]:
+        """
+        Send event and set its `sent_`/`status_` fields without saving. Return 'pause' if the destination
+        can not accept events now, the event is left pending then.
+        """
+        raise NotImplementedError
+
+    def push_event(self, event) -> t.Optional[str]:
+        status = self.deliver(event)
+        if status != 'pause':
+            with profiling.stage('status'):
+                event.save(update_fields=self.status_fields())
+        return status
 
-    def push_event(self, event) -> str:
-        raise NotImplemented
+    def send_batch(self, events: t.List[models.EventToDispatch],
+                   stats: batching.BatchStats) -> t.List[models.EventToDispatch]:
+        """
+        Deliver events until the destination pauses, return processed events. They are saved by the caller.
+        """
+        processed = []
+        for event in events:
+            if self.deliver(event) == 'pause':
+                stats.paused = True
+                break
+            processed.append(event)
+            if is_error(event, self.SERVICE_NAME):
+                stats.errors += 1
+            elif is_skipped(event, self.SERVICE_NAME):
+                stats.skipped += 1
+        return processed
 
     def validate_event(self, event):
         from analytics_dispatcher.event import dispatcher
 
-        if event.user_id is None:
+        if event.get_user() is None:
             event_type = dispatcher.get_event_type(event.event_type)
             if event_type is not None and not event_type.dont_log_without_user:
                 logger.warning('%s: attempt to emit event "%s" without user.', self.SERVICE_NAME, event.event_type)
-            setattr(event, 'sent_'+self.SERVICE_NAME, now())
-            event.status_user_dot_com = 'error: user missed'
-            event.save(update_fields=('sent_'+self.SERVICE_NAME, 'status_'+self.SERVICE_NAME))
+            set_status(event, self.SERVICE_NAME, models.DeliveryStatus.USER_MISSING)
             return 'next'
         return None
 
-    def process_batch(self, number: int = 500) -> int:
-        events_count = 0
-        filter_params = {
-            'send_' + self.SERVICE_NAME: True,
-            'sent_' + self.SERVICE_NAME: None,
-        }
-        while events_count < number:
-            with transaction.atomic():
-                event = (models.EventToDispatch.objects.select_for_update(skip_locked=True)
-                         .filter(**filter_params).order_by('timestamp')).first()
-                if event is None:
-                    break
-                status = self.push_event(event)
-                if status == 'next':
-                    continue
-                elif status == 'pause':
-                    break
-                events_count += 1
+    def process_batch(self, number: int = 500, shard: t.Optional[t.Tuple[int, int]] = None,
+                      stats: t.Optional[batching.BatchStats] = None) -> int:
+        """
+        Lease a batch of pending events, send it without holding a transaction and save the statuses.
+        """
+        if stats is None:
+            stats = batching.BatchStats()
+        events_count = leasing.process_batch(self, pending_events(self.SERVICE_NAME, shard), number, stats)
         if events_count > 0:
             logger.info('sent %d events to %s', events_count, self.SERVICE_NAME)
         return events_count
@@ -0,0 +1,74 @@
+import logging
+import os
+import threading
+import typing as t
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = (3.05, 10)
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 3
+
+_sessions = {}
+_sessions_pid = None
+_lock = threading.Lock()
+
+
+def _get_setting(name: str, destination: str, default):
+    value = getattr(settings, name, default)
+    if isinstance(value, dict):
+        return value.get(destination, value.get('default', default))
+    return value
+
+
+def get_timeout(destination: str) -> t.Union[float, t.Tuple[float, float]]:
+    """
+    (connect, read) timeout for a destination, DAD_HTTP_TIMEOUT may be a number, a tuple or a dict by destination.
+    """
+    timeout = _get_setting('DAD_HTTP_TIMEOUT', destination, DEFAULT_TIMEOUT)
+    if isinstance(timeout, list):
+        timeout = tuple(timeout)
+    return timeout
+
+
+def get_retries(destination: str) -> int:
+    return _get_setting('DAD_HTTP_RETRIES', destination, DEFAULT_RETRIES)
+
+
+def _build_session(destination: str) -> requests.Session:
+    pool_size = _get_setting('DAD_HTTP_POOL_SIZE', destination, DEFAULT_POOL_SIZE)
+    retries = get_retries(destination)
+    # retry on connection level only: requests which reached the server are not repeated
+    retry = Retry(total=retries, connect=retries, read=0, status=0, other=0,
+                  backoff_factor=0.2, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    logger.debug('created http session for %s, pool size %s', destination, pool_size)
+    return session
+
+
+def get_session(destination: str) -> requests.Session:
+    """
+    Keep-alive session shared by all clients of a destination within the process.
+    """
+    global _sessions_pid
+    pid = os.getpid()
+    session = _sessions.get(destination) if _sessions_pid == pid else None
+    if session is not None:
+        return session
+    with _lock:
+        if _sessions_pid != pid:
+            # do not share sockets with the parent process after fork
+            _sessions.clear()
+            _sessions_pid = pid
+        session = _sessions.get(destination)
+        if session is None:
+            session = _sessions[destination] = _build_session(destination)
+    return session
@@ -2,12 +2,12 @@ import logging
 import pprint
 import typing as t
 
-import requests
 from django.conf import settings
-from django.db.transaction import atomic
-from django.utils.timezone import now
 
-from ..models import EventToDispatch
+from . import _transport
+from ._base import AnalyticsBackend, set_statuses
+from .. import batching, profiling, serialization, sessions
+from ..models import DeliveryStatus, EventToDispatch
 
 logger = logging.getLogger(__name__)
 
@@ -29,18 +29,21 @@ class AmplitudeQualifiedError(AmplitudeError):
 class Amplitude:
     API_URL = 'https://api.amplitude.com/2/httpapi'
     HEADERS = {
-        'Content-Type': 'application/json',
+        'Content-Type': serialization.JSON_CONTENT_TYPE,
         'Accept': '*/*'
     }
 
     def __init__(self, api_key: str):
         self.api_key = api_key
+        self.session = _transport.get_session('amplitude')
 
     def _request(self, **data) -> dict:
         data.update({
             'api_key': self.api_key,
         })
-        r = requests.post(self.API_URL, headers=self.HEADERS, json=data)
+        with profiling.stage('http'):
+            r = self.session.post(self.API_URL, headers=self.HEADERS, data=serialization.dumps(data),
+                                  timeout=_transport.get_timeout('amplitude'))
         if 400 <= r.status_code < 500:
             if r.headers.get('Content-Type') == 'application/json':
                 raise AmplitudeQualifiedError(data, r.json(), r.status_code)
@@ -54,7 +57,7 @@ class Amplitude:
         return self._request(events=events)
 
 
-def _filter_events(events, map_name, response) -> t.List:
+def _filter_events(events, map_name, response) -> t.Tuple[t.List, t.List]:
     errors_map = response[map_name]
     to_drop = set()
     for k, v in errors_map.items():
@@ -68,60 +71,75 @@ def _filter_events(events, map_name, response) -> t.List:
         else:
             resulting_events.append(events[i])
 
-    EventToDispatch.objects.filter(pk__in=[event.pk for event in rejected_events]).update(
-        sent_amplitude=now(),
-        status_amplitude=map_name + str(errors_map),
-    )
+    set_statuses(rejected_events, 'amplitude', DeliveryStatus.REJECTED, map_name + str(errors_map))
 
     logger.warning('Filtered out %d events', len(events) - len(resulting_events))
 
-    return resulting_events
+    return resulting_events, rejected_events
 
 
-@atomic
-def process_batch(number: int = 100) -> int:
+def send_events(events: t.List[EventToDispatch], stats: batching.BatchStats) -> t.List[EventToDispatch]:
+    """
+    Send events in one request, set `sent_amplitude`/`status_amplitude` of delivered and rejected events.
+    Return processed events, they are saved by the caller.
+    """
     client = Amplitude(api_key=settings.AMPLITUDE_API_KEY)
 
-    events = list(EventToDispatch.objects
-                  .select_for_update(skip_locked=True)
-                  .filter(send_amplitude=True, sent_amplitude=None)
-                  .order_by('timestamp')[:number]
-                  )
+    processed = []
     sent = False
     loop_count = 5
-    events_count = 0
     users_cache = {}
     while not sent and loop_count > 0:
         loop_count -= 1
-        events_count = len(events)
-        if events_count == 0:
-            return 0
+        if len(events) == 0:
+            return processed
         try:
-            client.events([event.dict_for_amplutude(users_cache) for event in events])
+            with profiling.stage('payload'):
+                sessions.prefetch(events)
+                payload = [event.dict_for_amplutude(users_cache) for event in events]
+            client.events(payload)
             sent = True
         except AmplitudeQualifiedError as e:
             response = e.response
             code = response.get('code')
             if code == 429:
                 logger.warning("Too many requests for a user / device. Stop submitting")
-                return 0
+                stats.paused = True
+                return processed
             elif code == 400:
                 logger.warning("Invalid upload request. '%s'. Response: %r", response.get('error'), response)
-                if 'events_missing_required_fields' in response:
-                    events = _filter_events(events, 'events_missing_required_fields', response)
-                elif 'events_with_missing_fields' in response:
-                    events = _filter_events(events, 'events_with_missing_fields', response)
-                elif 'events_with_invalid_fields' in response:
-                    events = _filter_events(events, 'events_with_invalid_fields', response)
-                elif 'events_with_invalid_ids' in response:
-                    events = _filter_events(events, 'events_with_invalid_ids', response)
+                for map_name in ('events_missing_required_fields', 'events_with_missing_fields',
+                                 'events_with_invalid_fields', 'events_with_invalid_ids'):
+                    if map_name in response:
+                        events, rejected_events = _filter_events(events, map_name, response)
+                        break
                 else:
                     logger.error("Invalid upload request. '%s'. Response: %r", response.get('error'), response)
-                    return 0
+                    stats.errors += len(events)
+                    return processed
+                processed.extend(rejected_events)
+                stats.errors += len(rejected_events)
             else:
                 raise
 
-    EventToDispatch.objects.filter(pk__in=[event.pk for event in events]).update(sent_amplitude=now(),
-                                                                                 status_amplitude='ok')
-    logger.info('sent %d events to amplitude', events_count)
-    return events_count
+    set_statuses(events, 'amplitude', DeliveryStatus.OK)
+    processed.extend(events)
+    logger.info('sent %d events to amplitude', len(events))
+    return processed
+
+
+def process_batch(number: int = 100, shard: t.Optional[t.Tuple[int, int]] = None,
+                  stats: t.Optional[batching.BatchStats] = None) -> int:
+    return AmplitudeBackend().process_batch(number, shard=shard, stats=stats)
+
+
+class AmplitudeBackend(AnalyticsBackend):
+    SERVICE_NAME = 'amplitude'
+    SECRET_SETTINGS_NAME = 'AMPLITUDE_API_KEY'
+
+    def process_batch(self, number: int = 100, shard: t.Optional[t.Tuple[int, int]] = None,
+                      stats: t.Optional[batching.BatchStats] = None) -> int:
+        return super().process_batch(number, shard=shard, stats=stats)
+
+    def send_batch(self, events: t.List[EventToDispatch], stats: batching.BatchStats) -> t.List[EventToDispatch]:
+        return send_events(events, stats)
@@ -1,13 +1,11 @@
 import datetime
-import json
 import logging
 
 from django.conf import settings
-from django.utils import timezone
-import requests
 
-from ._base import AnalyticsBackend
-from .. import models
+from . import _transport
+from ._base import AnalyticsBackend, DestinationUnavailable, set_status
+from .. import models, payloads, profiling, serialization
 
 logger = logging.getLogger(__name__)
 
@@ -17,60 +15,59 @@ class Ga4Client(AnalyticsBackend):
     SECRET_SETTINGS_NAME = 'GA4_API_SECRET'
 
     BASE_URL = 'https://www.google-analytics.com/mp/collect'
-    API_SECRET = settings.GA4_API_SECRET
-    # FIREBASE_APP_ID = settings.GA4_FIREBASE_APP_ID
-    MEASUREMENT_ID = settings.GA4_MEASUREMENT_ID
-    CLIENT_ID = settings.GA4_CLIENT_ID
 
     def __init__(self):
         super().__init__()
-        self.session = requests.session()
+        self.api_secret = getattr(settings, 'GA4_API_SECRET', None)
+        # self.firebase_app_id = getattr(settings, 'GA4_FIREBASE_APP_ID', None)
+        self.measurement_id = getattr(settings, 'GA4_MEASUREMENT_ID', None)
+        self.client_id = getattr(settings, 'GA4_CLIENT_ID', None)
+        self.session = _transport.get_session(self.SERVICE_NAME)
 
     def __request(self, event_data, *, user_properties, user_id, timestamp: datetime.datetime):
-        if settings.GA4_API_SECRET is None:
+        if self.api_secret is None:
             logger.warning('GA4 is not enabled (GA4_API_SECRET is None).')
             return None
-        local_headers = {'Content-type': 'application/json'}
+        local_headers = {'Content-type': serialization.JSON_CONTENT_TYPE}
 
         auth_params = {
-            'api_secret': self.API_SECRET,
-            'measurement_id': self.MEASUREMENT_ID,
+            'api_secret': self.api_secret,
+            'measurement_id': self.measurement_id,
         }
 
         events_data2send = {
             'client_id': str(user_id),
             'non_personalized_ads': False,
             'user_id': str(user_id),
-            # 'timestamp_micros': int(timestamp.timestamp() * 1000),
+            'timestamp_micros': int(timestamp.timestamp() * 1_000_000),
             'user_properties': user_properties,
             'events': [event_data],
         }
-        response = self.session.post(self.BASE_URL, params=auth_params, headers=local_headers, json=events_data2send)
+        with profiling.stage('http'):
+            response = self.session.post(self.BASE_URL, params=auth_params, headers=local_headers,
+                                         data=serialization.dumps(events_data2send),
+                                         timeout=_transport.get_timeout(self.SERVICE_NAME))
         if response.status_code >= 300:
             logger.warning('GA4 request "%s" bad response with status: %s, body: "%s"',
-                           json.dumps(events_data2send), response.status_code, response.text)
+                           serialization.LazyJson(events_data2send), response.status_code, response.text)
+            if response.status_code >= 500:
+                raise DestinationUnavailable(f'GA4 response status {response.status_code}')
         else:
-            logger.info('GA4 request "%s" response with status: %s, body: "%s"',
-                        json.dumps(events_data2send), response.status_code, response.text)
+            serialization.log_payload(logger, logging.INFO, 'GA4 request "%s" response with status: %s, body: "%s"',
+                                      serialization.LazyJson(events_data2send), response.status_code, response.text)
         return response
 
-    def push_event(self, event: models.EventToDispatch) -> str:
+    def deliver(self, event: models.EventToDispatch) -> str:
         validate_res = self.validate_event(event)
         if validate_res is not None:
             return validate_res
 
-        user_data = event.user_properties
-        ga4_event = {'name': event.event_type,
-                     'params': {key: str(data) for key, data in event.event_properties.items()}}
+        with profiling.stage('payload'):
+            payload = payloads.get_payload(event, self.SERVICE_NAME)
+            ga4_event = {'name': event.event_type, 'params': payload['params']}
 
-        user_properties = {key[:24]: {"value": str(data)} for key, data in user_data.items()}
+        self.__request(ga4_event, user_id=event.get_user().id, user_properties=payload['user_properties'],
+                       timestamp=event.timestamp)
 
-        self.__request(ga4_event, user_id=event.user.id, user_properties=user_properties, timestamp=event.timestamp)
-
-        event.sent_ga4 = timezone.now()
-        event.status_ga4 = 'ok'
-        event.save(update_fields=('sent_ga4', 'status_ga4'))
+        set_status(event, self.SERVICE_NAME, models.DeliveryStatus.OK)
         return 'next'
-
-
-ga4_backend = Ga4Client()
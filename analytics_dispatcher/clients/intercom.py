@@ -3,14 +3,13 @@ import pprint
 import time
 import typing as t
 
-import requests
 from django.conf import settings
-from django.db import transaction
-from django.utils.timezone import now
 from requests import Response
 
+from . import _transport
+from ._base import AnalyticsBackend, set_status
 from ..utils import capture_exception
-from .. import models
+from .. import batching, models, payloads, profiling, serialization
 
 logger = logging.getLogger(__name__)
 
@@ -33,28 +32,30 @@ class IntercomQualifiedError(IntercomError):
         return pprint.pformat(self.response, indent=4)
 
 
-USER_ATTRIBUTES = {'user_id', 'email', 'phone', 'pseudonym', 'name',
-                   'referrer', 'utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content'}
+USER_ATTRIBUTES = payloads.INTERCOM_USER_ATTRIBUTES
 
 
 class IntercomClient:
     BASE_URL = 'https://api.intercom.io/'
-    ACCESS_TOKEN = settings.INTERCOM_ACCESS_TOKEN
 
     def __init__(self):
-        self.session = requests.Session()
+        self.access_token = getattr(settings, 'INTERCOM_ACCESS_TOKEN', None)
+        self.session = _transport.get_session('intercom')
 
     def _request(self, method: str, path: str, json_data: dict) -> t.Optional[Response]:
         url = self.BASE_URL + path
-        logger.info("intercom request %s %s %r", method, url, json_data)
+        serialization.log_payload(logger, logging.DEBUG, "intercom request %s %s %r", method, url, json_data)
 
         headers = {
-            'Authorization': 'Bearer ' + (self.ACCESS_TOKEN or '<no token defined>'),
+            'Authorization': 'Bearer ' + (self.access_token or '<no token defined>'),
             'Accept': 'application/json',
+            'Content-Type': serialization.JSON_CONTENT_TYPE,
         }
 
-        if self.ACCESS_TOKEN is not None:
-            resp = self.session.request(method, url, headers=headers, json=json_data)
+        if self.access_token is not None:
+            with profiling.stage('http'):
+                resp = self.session.request(method, url, headers=headers, data=serialization.dumps(json_data),
+                                            timeout=_transport.get_timeout('intercom'))
             if (400 <= resp.status_code < 500 or resp.status_code == 503) and resp.status_code != 404:
                 if resp.headers.get('Content-Type') == 'application/json':
                     raise IntercomQualifiedError(resp.json(), resp.status_code)
@@ -62,28 +63,25 @@ class IntercomClient:
                     raise IntercomError(resp.text, resp.status_code)
             elif resp.status_code != 404:
                 resp.raise_for_status()
-            logger.info("intercom API response %s %s %s %s", method, url, resp.status_code, resp.content)
+            logger.info("intercom API response %s %s %s", method, url, resp.status_code)
+            serialization.log_payload(logger, logging.DEBUG, "intercom API response body %s %s %s",
+                                      method, url, resp.content)
             return resp
         else:
             logger.info('intercom API call %s, %s, %r', method, url, json_data)
 
-    def create_or_update_user(self, user, user_properties):
+    def create_or_update_user(self, user, user_attributes):
+        """
+        `user_attributes` are prepared by `payloads.intercom`, they override attributes of the user snapshot.
+        """
         user_data = {
             'user_id': user.id,
             'email': user.email,
             'signed_up_at': user.timestamp_joined,
             'name': user.username,
         }
-        if user_properties:
-            custom_attributes = {}
-            for arg_name in user_properties.keys():
-                if arg_name in USER_ATTRIBUTES:
-                    user_data[arg_name] = user_properties[arg_name]
-                else:
-                    custom_attributes[arg_name] = user_properties[arg_name]
-            if len(custom_attributes) > 0:
-                user_data['custom_attributes'] = custom_attributes
-        if self.ACCESS_TOKEN is not None:
+        user_data.update(user_attributes)
+        if self.access_token is not None:
             resp = self._request('post', 'users', json_data=user_data)
             if resp is None or resp.status_code != 200:
                 logger.error('error on create or update user')
@@ -91,9 +89,10 @@ class IntercomClient:
         else:
             self._request('post', 'users', json_data=user_data)
 
-    def event(self, name, user, event_properties, user_properties):
-        logger.info('intercom event %s for user[%s] event_properties: %r, user_properties: %r',
-                    name, str(user), event_properties, user_properties)
+    def event(self, name, user, event_properties, user_attributes):
+        serialization.log_payload(logger, logging.INFO,
+                                  'intercom event %s for user[%s] event_properties: %r, user_attributes: %r',
+                                  name, user, event_properties, user_attributes)
         data = {
             'event_name': name,
             'created_at': int(time.time()),
@@ -107,9 +106,9 @@ class IntercomClient:
         if settings.DEBUG:
             return
 
-        if self.ACCESS_TOKEN is not None:
-            if len(user_properties) > 0:
-                self.create_or_update_user(user, user_properties)
+        if self.access_token is not None:
+            if len(user_attributes) > 0:
+                self.create_or_update_user(user, user_attributes)
 
             resp = self._request('post', 'events', json_data=data)
             if resp is not None and resp.status_code == 404:
@@ -131,29 +130,39 @@ class IntercomClient:
             self._request('post', 'events', json_data=data)
 
 
-api = IntercomClient()
+_api = None
+
+
+def get_api() -> IntercomClient:
+    global _api
+    if _api is None:
+        _api = IntercomClient()
+    return _api
 
 
-def send_event(event: models.EventToDispatch, client: IntercomClient = None):
+def deliver_event(event: models.EventToDispatch, client: IntercomClient = None) -> str:
+    """
+    Send event and set `sent_intercom`/`status_intercom` without saving.
+    """
     from analytics_dispatcher.event import dispatcher
 
     if client is None:
-        client = IntercomClient()
+        client = get_api()
 
-    if event.user_id is None:
+    user = event.get_user()
+    if user is None:
         event_type = dispatcher.get_event_type(event.event_type)
         if event_type is not None and not event_type.dont_log_without_user:
             logger.warning('intercom: attempt to emit event "%s" without user.', event.event_type)
-        event.sent_intercom = now()
-        event.status_intercom = 'error: user missed'
-        event.save(update_fields=('sent_intercom', 'status_intercom'))
+        set_status(event, 'intercom', models.DeliveryStatus.USER_MISSING)
         return 'next'
 
-    event_properties = event.dict_for_intercom_event()
-    user_properties = event.dict_for_intercom_user()
+    with profiling.stage('payload'):
+        payload = payloads.get_payload(event, 'intercom')
+        event_properties, user_attributes = payload['event_properties'], payload['user_attributes']
 
     try:
-        client.event(event.event_type, event.user, event_properties, user_properties)
+        client.event(event.event_type, user, event_properties, user_attributes)
     except IntercomQualifiedError as e:
         response = e.response
         if response.get('type') == 'error.list':
@@ -162,42 +171,41 @@ def send_event(event: models.EventToDispatch, client: IntercomClient = None):
                 logger.warning('Service unavailable, interrupt emitting process. Message from server: %r',
                                error0.get('message'))
                 return 'pause'
-        event.sent_intercom = now()
-        event.status_intercom = f'Error during emitting event. Code: {e.status}, response: {response}'
-        event.save(update_fields=('sent_intercom', 'status_intercom'))
+        set_status(event, 'intercom', models.DeliveryStatus.ERROR,
+                   f'Error during emitting event. Code: {e.status}, response: {response}')
         capture_exception()
         return 'next'
     except IntercomError as e:
         if e.status in (429, 503):
             logger.warning("Too many requests for a user / device, status: %s. Stop submitting", e.status)
             return 'pause'
-        event.sent_intercom = now()
-        event.status_intercom = f'Error during emitting event. Exception: {e}'
-        event.save(update_fields=('sent_intercom', 'status_intercom'))
+        set_status(event, 'intercom', models.DeliveryStatus.ERROR, f'Error during emitting event. Exception: {e}')
         capture_exception()
         return 'next'
-    event.sent_intercom = now()
-    event.status_intercom = 'ok'
-    event.save(update_fields=('sent_intercom', 'status_intercom'))
+    set_status(event, 'intercom', models.DeliveryStatus.OK)
     return 'next'
 
 
-def process_batch(number: int = 500) -> int:
-    client = IntercomClient()
-
-    events_count = 0
-    while events_count < number:
-        with transaction.atomic():
-            event = (models.EventToDispatch.objects.select_for_update(skip_locked=True)
-                     .filter(send_intercom=True, sent_intercom=None).order_by('timestamp')).first()
-            if event is None:
-                break
-            status = send_event(event, client=client)
-            if status == 'next':
-                continue
-            elif status == 'pause':
-                break
-            events_count += 1
-    if events_count > 0:
-        logger.info('sent %d events to intercom', events_count)
-    return events_count
+def send_event(event: models.EventToDispatch, client: IntercomClient = None) -> str:
+    status = deliver_event(event, client=client)
+    if status != 'pause':
+        with profiling.stage('status'):
+            event.save(update_fields=('sent_intercom', 'status_intercom'))
+    return status
+
+
+class IntercomBackend(AnalyticsBackend):
+    SERVICE_NAME = 'intercom'
+    SECRET_SETTINGS_NAME = 'INTERCOM_ACCESS_TOKEN'
+
+    def __init__(self):
+        super().__init__()
+        self.client = get_api()
+
+    def deliver(self, event: models.EventToDispatch) -> str:
+        return deliver_event(event, client=self.client)
+
+
+def process_batch(number: int = 500, shard: t.Optional[t.Tuple[int, int]] = None,
+                  stats: t.Optional[batching.BatchStats] = None) -> int:
+    return IntercomBackend().process_batch(number, shard=shard, stats=stats)
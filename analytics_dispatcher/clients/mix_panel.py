@@ -1,15 +1,15 @@
 import logging
 
 from django.conf import settings
-from django.utils.timezone import now
 try:
-    from mixpanel import Mixpanel
+    from mixpanel import Consumer, Mixpanel
     mixpanel_installed = True
 except:
     mixpanel_installed = False
 
-from analytics_dispatcher import models
-from analytics_dispatcher.clients._base import AnalyticsBackend
+from analytics_dispatcher import models, payloads, profiling, serialization
+from analytics_dispatcher.clients import _transport
+from analytics_dispatcher.clients._base import AnalyticsBackend, set_status
 
 
 logger = logging.getLogger(__name__)
@@ -23,17 +23,23 @@ class MixPanelBackend(AnalyticsBackend):
         self.mp = None
         if not hasattr(settings, 'MIXPANEL_TOKEN') or not settings.MIXPANEL_TOKEN:
             return
-        self.mp = Mixpanel(settings.MIXPANEL_TOKEN)
+        # mixpanel consumer keeps its own connection pool, only timeout and retries are configured
+        timeout = _transport.get_timeout(self.SERVICE_NAME)
+        consumer = Consumer(request_timeout=max(timeout) if isinstance(timeout, tuple) else timeout,
+                            retry_limit=_transport.get_retries(self.SERVICE_NAME))
+        self.mp = Mixpanel(settings.MIXPANEL_TOKEN, consumer=consumer)
 
     def _ll_send_event(self, user_id, event, data):
-        logger.info('Mixpanel track event for user %s, event %s, data: %r', user_id, event, data)
+        serialization.log_payload(logger, logging.INFO, 'Mixpanel track event for user %s, event %s, data: %r',
+                                  user_id, event, data)
         if self.mp is not None:
-            self.mp.track(user_id, event, data)
+            with profiling.stage('http'):
+                self.mp.track(user_id, event, data)
         else:
             logger.info('Mixpanel not configured, skip tracking of event')
 
     def _ll_save_user(self, user_id, data):
-        logger.info('Mixpanel add user %s, data: %r', user_id, data)
+        serialization.log_payload(logger, logging.INFO, 'Mixpanel add user %s, data: %r', user_id, data)
         if not settings.MIXPANEL_TOKEN:
             return
         properties = {
@@ -42,29 +48,27 @@ class MixPanelBackend(AnalyticsBackend):
             '$email': data.get('email'),
             '$phone': data.get('phone')
         }
-        self.mp.people_set(
-            user_id,
-            properties,
-            meta={
-                '$ignore_time': 'true',
-                'ip': data.get('ip')
-            }
-        )
+        with profiling.stage('http'):
+            self.mp.people_set(
+                user_id,
+                properties,
+                meta={
+                    '$ignore_time': 'true',
+                    'ip': data.get('ip')
+                }
+            )
 
-    def push_event(self, event: models.EventToDispatch):
-        user_properties = event.user_properties
-        user_id = user_properties.pop('user_id', None)
+    def deliver(self, event: models.EventToDispatch):
+        with profiling.stage('payload'):
+            payload = payloads.get_payload(event, self.SERVICE_NAME)
+        user_properties, user_id = payload['user_properties'], payload['user_id']
         if event.event_type == '':
             if user_id is not None:
                 self._ll_save_user(user_id, user_properties)
         else:
-            if event.user_id is not None:
-                user_id = event.user_id
-        self._ll_send_event(user_id, event.event_type, event.event_properties)
+            user = event.get_user()
+            if user is not None:
+                user_id = user.id
+        self._ll_send_event(user_id, event.event_type, payload['event_properties'])
 
-        event.sent_mix_panel = now()
-        event.status_mix_panel = 'ok'
-        event.save(update_fields=('sent_mix_panel', 'status_mix_panel'))
-
-
-mix_panel_backend = MixPanelBackend()
+        set_status(event, self.SERVICE_NAME, models.DeliveryStatus.OK)
@@ -0,0 +1,87 @@
+import logging
+import threading
+import typing as t
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.timezone import now
+from django.utils.module_loading import import_string
+
+from analytics_dispatcher import models
+
+from ._base import AnalyticsBackend
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKENDS = {
+    'amplitude': 'analytics_dispatcher.clients.amplitude.AmplitudeBackend',
+    'intercom': 'analytics_dispatcher.clients.intercom.IntercomBackend',
+    'user_dot_com': 'analytics_dispatcher.clients.user_dot_com.UserDotComBackend',
+    'mix_panel': 'analytics_dispatcher.clients.mix_panel.MixPanelBackend',
+    'ga4': 'analytics_dispatcher.clients.ga4.Ga4Client',
+}
+
+_backends = None
+_lock = threading.Lock()
+
+
+def get_backend_paths() -> t.Dict[str, str]:
+    """
+    DAD_BACKENDS replaces default backends by destination name, None disables a destination.
+    Only destinations with fields in `EventToDispatch` can be configured.
+    """
+    overrides = getattr(settings, 'DAD_BACKENDS', {})
+    unknown = sorted(set(overrides) - set(models.DESTINATIONS))
+    if unknown:
+        raise ImproperlyConfigured(f'DAD_BACKENDS has unknown destinations {", ".join(unknown)}, '
+                                   f'expected one of {", ".join(models.DESTINATIONS)}')
+    paths = dict(DEFAULT_BACKENDS)
+    paths.update(overrides)
+    return {name: path for name, path in paths.items() if path is not None}
+
+
+def _load_backends() -> t.Dict[str, AnalyticsBackend]:
+    backends = {}
+    for name, path in get_backend_paths().items():
+        backend_class = import_string(path)
+        if not backend_class.is_enabled():
+            logger.info('analytics backend %s is not configured (%s is missed)',
+                        name, backend_class.SECRET_SETTINGS_NAME)
+            continue
+        backends[name] = backend_class()
+    return backends
+
+
+def get_backends() -> t.Dict[str, AnalyticsBackend]:
+    """
+    Configured backends by destination name. Client modules are imported and backends are built on first use.
+    """
+    global _backends
+    if _backends is None:
+        with _lock:
+            if _backends is None:
+                _backends = _load_backends()
+    return _backends
+
+
+def get_backend(name: str) -> t.Optional[AnalyticsBackend]:
+    return get_backends().get(name)
+
+
+def mark_disabled() -> int:
+    """
+    Mark events pending for destinations without a backend (disabled or missing credentials) as DISABLED,
+    otherwise they stay pending and cleanup never removes them. Return their number.
+    """
+    backends = get_backends()
+    at = now()
+    marked = 0
+    for name in models.DESTINATIONS:
+        if name in backends:
+            continue
+        count = (models.EventToDispatch.objects.filter(models.pending_q(name))
+                 .update(**{'sent_' + name: at, 'status_' + name: models.DeliveryStatus.DISABLED}))
+        if count:
+            logger.info('%d events of disabled destination %s closed', count, name)
+        marked += count
+    return marked
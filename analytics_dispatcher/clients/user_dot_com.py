@@ -1,10 +1,10 @@
 import logging
 
-import requests
 from django.conf import settings
-from django.utils.timezone import now
 
-from ._base import AnalyticsBackend
+from . import _transport
+from ._base import AnalyticsBackend, DestinationUnavailable, set_status
+from .. import models, profiling, serialization
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +15,7 @@ class UserDotComBackend(AnalyticsBackend):
 
     def __init__(self):
         super().__init__()
-        self.session = requests.session()
+        self.session = _transport.get_session(self.SERVICE_NAME)
 
     def __request(self, method, path, data, headers=None):
         if settings.USER_DOT_COM_API_KEY is None:
@@ -26,19 +26,25 @@ class UserDotComBackend(AnalyticsBackend):
             local_headers.update(headers)
         local_headers.update({
             'Authorization': 'Token ' + settings.USER_DOT_COM_API_KEY,
-            'Content-type': 'application/json'
+            'Content-type': serialization.JSON_CONTENT_TYPE
         })
         url = f'https://{settings.USER_DOT_COM_APP}.user.com/api/public' + path
-        if method == 'get':
-            response = self.session.request(method, url, headers=local_headers)
-        else:
-            response = self.session.request(method, url, headers=local_headers, json=data)
+        timeout = _transport.get_timeout(self.SERVICE_NAME)
+        with profiling.stage('http'):
+            if method == 'get':
+                response = self.session.request(method, url, headers=local_headers, timeout=timeout)
+            else:
+                response = self.session.request(method, url, headers=local_headers,
+                                                data=serialization.dumps(data), timeout=timeout)
         if response.status_code >= 300:
             logger.warning('user.com request "%s %s %s" bad response with status: %s, body: %s',
                            method, path, data, response.status_code, response.text)
+            if response.status_code >= 500:
+                raise DestinationUnavailable(f'user.com response status {response.status_code}')
         else:
-            logger.info('user.com request "%s %s %s" response with status: %s, body: %s',
-                        method, path, data, response.status_code, response.text)
+            serialization.log_payload(logger, logging.INFO,
+                                      'user.com request "%s %s %s" response with status: %s, body: %s',
+                                      method, path, data, response.status_code, response.text)
         return response
 
     def create_user(self, user):
@@ -71,20 +77,19 @@ class UserDotComBackend(AnalyticsBackend):
         if event_response.status_code == 404:
             self.create_user(user)
             event_response = self.__request('post', request_url, request_data)
-        self.set_user_custom_attributes(user.id, user_data)
+        try:
+            self.set_user_custom_attributes(user.id, user_data)
+        except DestinationUnavailable as e:
+            # the event is delivered, leaving it pending would send it again
+            logger.warning('user.com attributes of user %s are not updated: %s', user.id, e)
         return event_response
 
-    def push_event(self, event) -> str:
+    def deliver(self, event) -> str:
         validate_res = self.validate_event(event)
         if validate_res is not None:
             return validate_res
 
-        self.send_event(event.event_type, event.user, event.timestamp.timestamp(),
+        self.send_event(event.event_type, event.get_user(), event.timestamp.timestamp(),
                         event.event_properties, user_data=event.user_properties)
-        event.sent_user_dot_com = now()
-        event.status_user_dot_com = 'ok'
-        event.save(update_fields=('sent_user_dot_com', 'status_user_dot_com'))
+        set_status(event, self.SERVICE_NAME, models.DeliveryStatus.OK)
         return 'next'
-
-
-user_dot_com_backend = UserDotComBackend()
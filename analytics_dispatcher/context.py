@@ -0,0 +1,72 @@
+import types
+import typing as t
+
+from django.conf import settings
+from django.http import HttpRequest
+from ipware import get_client_ip
+from ua_parser import user_agent_parser
+
+from . import profiling
+
+REQUEST_ATTRIBUTE = '_analytics_context'
+
+
+class AnalyticsContext(t.NamedTuple):
+    """
+    Request dependent part of events, built once per request and shared by all its events.
+    """
+    # read-only, `emit` copies it into `EventToDispatch.session_data`
+    session_data: t.Mapping[str, t.Any]
+    device_id: t.Optional[str] = None
+
+
+def build(request: t.Optional[HttpRequest] = None) -> AnalyticsContext:
+    session_data = {
+        'app_version': settings.GIT_HASH_SHORT,
+        'platform': 'web',
+    }
+
+    with profiling.stage('user_agent'):
+        user_agent = user_agent_parser.Parse((request.META.get('HTTP_USER_AGENT') if request else '') or '')
+    os = user_agent['os']
+    device = user_agent['device']
+    if request is not None:
+        with profiling.stage('client_ip'):
+            session_data['ip'] = str(get_client_ip(request)[0])
+
+    if hasattr(request, 'device_id'):
+        session_data['device_id'] = getattr(request, 'device_id')
+    if hasattr(request, 'session_id'):
+        session_data['session_id'] = getattr(request, 'session_id')
+    if os['family']:
+        session_data['os_name'] = os['family']
+    os_version = '.'.join(filter(None, (os['major'], os['minor'], os['patch'], os['patch_minor']))) or ''
+    if os_version:
+        session_data['os_version'] = os_version
+    if device['family']:
+        session_data['device_brand'] = device['family']
+    if device['brand']:
+        session_data['device_manufacturer'] = device['brand']
+    if device['model']:
+        session_data['device_model'] = device['model']
+
+    return AnalyticsContext(types.MappingProxyType(session_data), session_data.get('device_id'))
+
+
+_no_request_context = None
+
+
+def get_context(request: t.Optional[HttpRequest] = None) -> AnalyticsContext:
+    """
+    Context of `request`, it is built on the first call and kept on the request.
+    """
+    global _no_request_context
+    if request is None:
+        if _no_request_context is None:
+            _no_request_context = build()
+        return _no_request_context
+    context = getattr(request, REQUEST_ATTRIBUTE, None)
+    if context is None:
+        context = build(request)
+        setattr(request, REQUEST_ATTRIBUTE, context)
+    return context
@@ -4,6 +4,21 @@ EventType = collections.namedtuple('EventType',
                                    ['name',
                                     'send_intercom', 'send_user_dot_com', 'send_amplitude', 'send_mix_panel',
                                     'send_ga4',
-                                    'instant_send_intercom', 'dont_log_without_user'],
-                                   defaults=(None, False, False, False, False, False, False, False)
+                                    'instant_send_intercom', 'dont_log_without_user',
+                                    # share of users (or devices) whose events are stored, 0.0 - 1.0
+                                    'sample_rate',
+                                    # (number of events, seconds) allowed per user (or device), None - no limit
+                                    'rate_limit',
+                                    # 'user' (falls back to device for anonymous events) or 'device'
+                                    'limit_by',
+                                    # seconds, events of a user with equal properties are collapsed into one
+                                    'rollup_window',
+                                    # dispatch lane, pending events of higher lanes are sent first
+                                    'priority',
+                                    # {'event_properties': {name: type}, 'user_properties': {...}}, see `schemas`
+                                    'schema',
+                                    # seconds, older pending events are expired instead of sent, None - no limit
+                                    'max_age'],
+                                   defaults=(None, False, False, False, False, False, False, False,
+                                             1.0, None, 'user', 0, 0, None, None)
                                    )
@@ -1,19 +1,21 @@
+import functools
 import logging
+import time
 import typing as t
 from datetime import timedelta
 
-from analytics_dispatcher.clients import mix_panel
 from django.conf import settings
-from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
 from django.db.models import Q
 from django.http import HttpRequest
 from django.utils.timezone import now
-from ipware import get_client_ip
-from ua_parser import user_agent_parser
 
-from .clients import intercom, amplitude, user_dot_com, ga4
+from . import (batching, circuit, context as analytics_context, expiry, fanout, idempotency, instant, leasing,
+               profiling, rollup, routers, sampling, schemas, serialization, sessions, sharding, users)
+from .clients import registry
+from .clients._base import pending_events
 from .data_structures import EventType
-from .models import EventToDispatch
+from .models import DeliveryError, EventToDispatch, SessionInfo
 
 logger = logging.getLogger(__name__)
 
@@ -41,6 +43,7 @@ class EventsDispatcher:
 
         self.__run_task = run_task
         self.__event_dict = {t.name: t for t in DAD_EVENT_TYPES}
+        self.__schemas = schemas.compile_event_types(DAD_EVENT_TYPES)
         try:
             capture_exception = settings.DAD_CAPTURE_EXCEPTION
         except AttributeError:
@@ -56,7 +59,12 @@ class EventsDispatcher:
                 self.capture_exception()
                 return
             self.__run_task = getattr(module, name, None)
-        self.__run_task(self.process_event_queue)
+        shard_count = sharding.get_shard_count()
+        if shard_count:
+            # an unsharded run would send events of a user concurrently with the worker owning their shard
+            self.__run_task(functools.partial(self.process_event_queue_sharded, shard_count, clean=True))
+        else:
+            self.__run_task(self.process_event_queue)
 
     def capture_exception(self):
         if isinstance(self.__capture_exception, str):
@@ -90,126 +98,323 @@ class EventsDispatcher:
                        ).delete()[0]
         deleted_cnt += EventToDispatch.objects.filter(timestamp__lt=now() - timedelta(days=age*2)).delete()[0]
         logger.info('cleanup_old_events deleted %s records', deleted_cnt)
-
-    def process_event_queue(self, clean: bool = True):
-        logger.info('process_event_queue started')
+        deleted_cnt = DeliveryError.objects.filter(created_at__lt=now() - timedelta(days=age*2)).delete()[0]
+        logger.info('cleanup_old_events deleted %s delivery errors', deleted_cnt)
+        deleted_cnt = leasing.cleanup_expired()
+        logger.info('cleanup_old_events deleted %s expired leases', deleted_cnt)
+        if sessions.is_enabled():
+            deleted_cnt = SessionInfo.objects.filter(created_at__lt=now() - timedelta(days=age/14),
+                                                     events__isnull=True).delete()[0]
+            logger.info('cleanup_old_events deleted %s sessions', deleted_cnt)
+
+    def _process_destination(self, name: str, process_batch: t.Callable[..., int],
+                             shard: t.Optional[t.Tuple[int, int]] = None,
+                             keep_going: t.Optional[t.Callable[[], bool]] = None, pending=None,
+                             breaker: t.Optional[circuit.CircuitBreaker] = None,
+                             destinations: t.Optional[t.List[str]] = None) -> int:
+        """
+        Process batches of a destination until its queue is empty, the destination throttles us
+        or the time budget of the run is spent. Batch size is adapted by `batching.BatchController`.
+        While `breaker` is open the destination is skipped, a half-open one gets single events until one of them
+        reaches the destination. Only runs which made requests count as a success.
+        Events too old for `destinations` (default is [name]) are expired before the first batch.
+        """
+        probe = False
+        if breaker is not None:
+            state = breaker.acquire()
+            if state == circuit.OPEN:
+                logger.info('%s circuit is open, skipped', name)
+                return 0
+            probe = state == circuit.HALF_OPEN
+        if pending is None:
+            pending = pending_events(name, shard)
+        controller = batching.get_controller(name)
+        events_count = 0
+        delivered = 0
         try:
-            while amplitude.process_batch() > 0:
-                pass
-        except amplitude.AmplitudeError as e:
+            with profiling.profile('dispatch.' + name):
+                with profiling.stage('expire'):
+                    for destination in destinations or [name]:
+                        expiry.expire_stale(destination, shard)
+                with profiling.stage('backlog'):
+                    backlog = pending[:controller.max_size].count()
+                if backlog == 0:
+                    if probe:
+                        breaker.release_probe()
+                    return 0
+                deadline = time.monotonic() + controller.start_run(backlog)
+                while True:
+                    # events skipped without a request tell nothing about the destination
+                    probing = probe and delivered == 0
+                    number = 1 if probing else controller.size
+                    stats = batching.BatchStats()
+                    started = time.monotonic()
+                    try:
+                        batch_count = process_batch(number=number, shard=shard, stats=stats)
+                    except Exception:
+                        controller.record_failure()
+                        raise
+                    if not probing:
+                        controller.record(number, batch_count, time.monotonic() - started, stats)
+                    elif batch_count > stats.skipped and not stats.paused:
+                        logger.info('%s probe succeeded', name)
+                        breaker.record_success()
+                    events_count += batch_count
+                    delivered += batch_count - stats.skipped
+                    if (batch_count < number or stats.paused or time.monotonic() > deadline
+                            or (keep_going is not None and not keep_going())):
+                        break
+            if breaker is not None:
+                if stats.paused:
+                    # throttling is not a success, a destination which keeps pausing opens the circuit
+                    breaker.record_failure()
+                elif delivered > 0:
+                    breaker.record_success()
+                elif probe:
+                    breaker.release_probe()
+        except Exception as e:
+            if breaker is not None:
+                breaker.record_failure()
             if self.capture_exception:
                 self.capture_exception()
-            logger.error("Error on submitting events to amplitude: %s", str(e))
-
+            logger.error("Error on submitting events to %s: %s", name, str(e))
+        return events_count
+
+    def use_fanout(self, fanout_mode: t.Optional[bool] = None) -> bool:
+        if fanout_mode is None:
+            fanout_mode = getattr(settings, 'DAD_FANOUT', False)
+        return fanout_mode
+
+    def _process_fanout(self, shard: t.Optional[t.Tuple[int, int]] = None,
+                        keep_going: t.Optional[t.Callable[[], bool]] = None) -> int:
+        backends = registry.get_backends()
+        if not backends:
+            return 0
+        fanout_pass = fanout.Fanout(backends, self.capture_exception)
         try:
-            intercom.process_batch()
-        except intercom.IntercomError as e:
-            if self.capture_exception:
-                self.capture_exception()
-            logger.error("Error on submitting events to intercom: %s", str(e))
+            return self._process_destination(fanout.NAME, fanout_pass.process_batch, shard=shard,
+                                             keep_going=keep_going, pending=fanout_pass.pending_events(shard),
+                                             destinations=fanout_pass.active())
+        finally:
+            fanout_pass.release_probes()
+
+    def process_event_queue(self, clean: bool = True, fanout_mode: t.Optional[bool] = None):
+        """
+        With `fanout_mode` (default is DAD_FANOUT) the queue is read once for all destinations,
+        otherwise each destination polls the queue separately.
+        """
+        logger.info('process_event_queue started')
+        registry.mark_disabled()
+        if self.use_fanout(fanout_mode):
+            self._process_fanout()
+        else:
+            for name, backend in registry.get_backends().items():
+                self._process_destination(name, backend.process_batch, breaker=circuit.get_breaker(name))
 
-        try:
-            user_dot_com.user_dot_com_backend.process_batch()
-        except Exception as e:
-            if self.capture_exception:
-                self.capture_exception()
-            logger.error("Error on submitting events to user.com: %s", str(e))
+        if clean:
+            self.cleanup_old_events()
 
-        try:
-            mix_panel.mix_panel_backend.process_batch()
-        except Exception as e:
-            if self.capture_exception:
-                self.capture_exception()
-            logger.error("Error on submitting events to mix_panel: %s", str(e))
+    def process_event_queue_sharded(self, shard_count: int, worker_id: t.Optional[str] = None,
+                                    lease_ttl: int = sharding.DEFAULT_LEASE_TTL, clean: bool = False,
+                                    fanout_mode: t.Optional[bool] = None):
+        """
+        Process the part of queue owned by this worker. Events are split by `user_id` into `shard_count` shards
+        per destination and a shard is processed by one worker at a time, so events of a user stay in order.
+        All workers must use the same `shard_count`.
+        """
+        worker_id = worker_id or sharding.default_worker_id()
+        logger.info('process_event_queue started by %s with %d shards', worker_id, shard_count)
+        registry.mark_disabled()
+        if self.use_fanout(fanout_mode):
+            for shard in sharding.shard_order(shard_count, worker_id):
+                if not sharding.acquire(fanout.NAME, shard, worker_id, lease_ttl):
+                    continue
+                try:
+                    self._process_fanout(
+                        shard=(shard, shard_count),
+                        keep_going=lambda: sharding.acquire(fanout.NAME, shard, worker_id, lease_ttl))
+                finally:
+                    sharding.release(fanout.NAME, shard, worker_id)
+            if clean:
+                self.cleanup_old_events()
+            return
 
-        try:
-            ga4.ga4_backend.process_batch()
-        except Exception as e:
-            if self.capture_exception:
-                self.capture_exception()
-            logger.error("Error on submitting events to GA4: %s", str(e))
+        for name, backend in registry.get_backends().items():
+            for shard in sharding.shard_order(shard_count, worker_id):
+                if not sharding.acquire(name, shard, worker_id, lease_ttl):
+                    continue
+                try:
+                    self._process_destination(
+                        name, backend.process_batch, shard=(shard, shard_count),
+                        keep_going=lambda: sharding.acquire(name, shard, worker_id, lease_ttl),
+                        breaker=circuit.get_breaker(name))
+                finally:
+                    sharding.release(name, shard, worker_id)
 
         if clean:
             self.cleanup_old_events()
 
+    @profiling.profiled('emit')
     def emit(self,
              event_name: str,
              request: t.Optional[HttpRequest] = None,
              user=None, user_id=None,
              user_properties: t.Optional[dict] = None,
              event_properties: t.Optional[dict] = None,
-             instant_send_intercom: bool = False):
-
-        User = get_user_model()
-
+             instant_send_intercom: bool = False,
+             idempotency_key: t.Optional[str] = None,
+             context: t.Optional[analytics_context.AnalyticsContext] = None,
+             raise_invalid: bool = False):
+        """
+        Queue an event. `context` is taken from `request` (built once per request) unless passed explicitly.
+        Events not matching the `schema` of their type are logged and dropped, or raise `schemas.InvalidEvent`
+        with `raise_invalid`.
+        """
         event_type = self.get_event_type(event_name)
         if event_type is None:
             return
 
+        schema = self.__schemas.get(event_name)
+        if schema is not None:
+            with profiling.stage('validate'):
+                errors = schema.validate(event_properties or {}, user_properties or {})
+            if errors:
+                if raise_invalid:
+                    raise schemas.InvalidEvent(event_name, errors)
+                logger.error('invalid analytics event "%s" dropped: %s', event_name, '; '.join(errors))
+                return
+
+        if context is None:
+            context = analytics_context.get_context(request)
+
+        if event_type.sample_rate < 1.0 or event_type.rate_limit is not None:
+            with profiling.stage('sampling'):
+                if user is not None:
+                    subject_user_id = user.pk
+                elif user_id is not None:
+                    subject_user_id = user_id
+                elif request is not None and request.user.is_authenticated:
+                    subject_user_id = request.user.pk
+                else:
+                    subject_user_id = None
+                if not sampling.accept(event_type, subject_user_id, context.device_id):
+                    return
+
+        if idempotency_key is not None:
+            idempotency_key, previous_key = idempotency.make_keys(event_name, idempotency_key)
+            if idempotency.is_duplicate(idempotency_key, previous_key):
+                logger.info('duplicate analytics event "%s" dropped', event_name)
+                return
+
         if event_properties is None:
             event_properties = {}
+        if event_type.sample_rate < 1.0:
+            event_properties = dict(event_properties)
+            event_properties[sampling.sample_weight_property()] = 1 / event_type.sample_rate
 
-        session_data = {
-            'app_version': settings.GIT_HASH_SHORT,
-            'platform': 'web',
-        }
-
-        user_agent = user_agent_parser.Parse((request.META.get('HTTP_USER_AGENT') if request else '') or '')
-        os = user_agent['os']
-        device = user_agent['device']
-        if user is None:
-            if user_id is not None:
-                user = User.objects.get(id=user_id)
-            elif request is not None and request.user.is_authenticated:
+        with profiling.stage('user'):
+            if user is None and user_id is None and request is not None and request.user.is_authenticated:
                 user = request.user
-        if request is not None:
-            session_data['ip'] = str(get_client_ip(request)[0])
+            user_snapshot = users.get_snapshot(user=user, user_id=user_id)
         user_properties2send = {}
         if user_properties is not None:
             user_properties2send.update(user_properties)
-        send_intercom = event_type.send_intercom
-        if event_type.instant_send_intercom or instant_send_intercom:
-            send_intercom = False
-
-        if hasattr(request, 'device_id'):
-            session_data['device_id'] = getattr(request, 'device_id')
-        if hasattr(request, 'session_id'):
-            session_data['session_id'] = getattr(request, 'session_id')
-        if os['family']:
-            session_data['os_name'] = os['family']
-        os_version = '.'.join(filter(None, (os['major'], os['minor'], os['patch'], os['patch_minor']))) or ''
-        if os_version:
-            session_data['os_version'] = os_version
-        if device['family']:
-            session_data['device_brand'] = device['family']
-        if device['brand']:
-            session_data['device_manufacturer'] = device['brand']
-        if device['model']:
-            session_data['device_model'] = device['model']
-
-        event = EventToDispatch.objects.create(
-            user=user,
-            event_type=event_name,
-            session_data=session_data,
-            event_properties=event_properties,
-            user_properties=user_properties2send,
-            send_amplitude=event_type.send_amplitude,
-            send_intercom=send_intercom,
-            send_user_dot_com=event_type.send_user_dot_com,
-            send_mix_panel=event_type.send_mix_panel,
-            send_ga4=event_type.send_ga4,
-        )
-        logger.debug('got analytics event: %s', event.as_dict())
-        if event_type.instant_send_intercom or instant_send_intercom:
+        instant_intercom = event_type.instant_send_intercom or instant_send_intercom
+        # instant events are queued too, the background send leases them and the regular dispatch is a fallback
+        send_intercom = event_type.send_intercom or instant_intercom
+        priority = max(event_type.priority, instant.get_priority()) if instant_intercom else event_type.priority
+
+        session_data = dict(context.session_data)
+
+        rollup_key = None
+        if event_type.rollup_window:
+            with profiling.stage('rollup'):
+                subject = user_snapshot.id if user_snapshot is not None else session_data.get('device_id')
+                rollup_key = rollup.make_key(event_name, subject, event_properties)
+                if rollup.collapse(rollup_key, event_type.rollup_window) is not None:
+                    return
+                event_properties = rollup.init_properties(event_properties)
+
+        session_id = None
+        if sessions.is_enabled():
+            with profiling.stage('session'):
+                session_id = sessions.intern(session_data)
+            session_data = {}
+
+        payloads = None
+        if schema is not None:
+            with profiling.stage('payload'):
+                destinations = [destination for destination, send in (
+                    ('ga4', event_type.send_ga4), ('mix_panel', event_type.send_mix_panel),
+                    ('intercom', send_intercom)) if send]
+                payloads = schema.build_payloads(event_properties, user_properties2send, destinations)
+
+        with profiling.stage('insert'):
+            try:
+                with transaction.atomic(using=routers.get_database()):
+                    event = EventToDispatch.objects.create(
+                        user_id=user_snapshot.id if user_snapshot is not None else None,
+                        user_snapshot=user_snapshot,
+                        event_type=event_name,
+                        session_data=session_data,
+                        session_id=session_id,
+                        event_properties=event_properties,
+                        user_properties=user_properties2send,
+                        idempotency_key=idempotency_key,
+                        rollup_key=rollup_key,
+                        priority=priority,
+                        payloads=payloads,
+                        send_amplitude=event_type.send_amplitude,
+                        send_intercom=send_intercom,
+                        send_user_dot_com=event_type.send_user_dot_com,
+                        send_mix_panel=event_type.send_mix_panel,
+                        send_ga4=event_type.send_ga4,
+                    )
+            except IntegrityError:
+                if idempotency_key is None:
+                    raise
+                idempotency.recent_keys.add(idempotency_key)
+                logger.info('duplicate analytics event "%s" dropped', event_name)
+                return
+        if idempotency_key is not None:
+            idempotency.recent_keys.add(idempotency_key)
+        if serialization.payload_logging_enabled(logger, logging.DEBUG):
+            logger.debug('got analytics event: %s', event.as_dict())
+        if instant_intercom:
             logger.info('instant send to intercom, event: %s', event)
-            status = intercom.send_event(event)
-            if status == 'pause':
-                logger.info('instant send to intercom got retry status')
-                event.send_intercom = True
-                event.save(update_fields=['send_intercom'])
-        self.schedule_process_events()
+            with profiling.stage('instant_intercom'):
+                transaction.on_commit(lambda: self._submit_instant_intercom(event), using=routers.get_database())
+        with profiling.stage('schedule'):
+            self.schedule_process_events()
         # main_models.WorkerTask.single_add(event_sender.process_event_queue)
 
+    def _submit_instant_intercom(self, event: EventToDispatch):
+        if not instant.submit(self._send_intercom_instantly, event):
+            logger.info('instant send executor is full or disabled, event is left to dispatch')
+
+    def _send_intercom_instantly(self, event: EventToDispatch):
+        from .clients import intercom
+
+        pending = EventToDispatch.objects.filter(pk=event.pk, send_intercom=True, sent_intercom=None)
+        token, events = leasing.claim(pending, intercom.IntercomBackend.SERVICE_NAME, 1,
+                                      conflicting=(intercom.IntercomBackend.SERVICE_NAME, leasing.FANOUT))
+        if not events:
+            logger.info('instant send to intercom skipped, event is leased by dispatch')
+            return
+        processed = []
+        try:
+            status = intercom.deliver_event(events[0])
+        except Exception:
+            self.capture_exception()
+            status = 'pause'
+        finally:
+            if events[0].sent_intercom is not None:
+                processed = events
+            leasing.release(token, processed, intercom.IntercomBackend.status_fields())
+        if status == 'pause':
+            logger.info('instant send to intercom got retry status, event is left to dispatch')
+            self.schedule_process_events()
+
     def update_user(self, user_id, user_properties: dict):
         u_p = {}
         u_p.update(user_properties)
@@ -221,3 +426,4 @@ dispatcher = EventsDispatcher()
 emit = dispatcher.emit
 get_event_type = dispatcher.get_event_type
 process_event_queue = dispatcher.process_event_queue
+process_event_queue_sharded = dispatcher.process_event_queue_sharded
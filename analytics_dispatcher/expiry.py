@@ -0,0 +1,59 @@
+import datetime
+import functools
+import logging
+import operator
+import typing as t
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.timezone import now
+
+from . import sharding
+from .models import DeliveryStatus, EventToDispatch, pending_q
+
+logger = logging.getLogger(__name__)
+
+# seconds, GA4 ignores events with timestamp_micros older than 72 hours
+DEFAULT_MAX_EVENT_AGE = {
+    'ga4': 72 * 3600,
+}
+
+
+def get_max_age(destination: str) -> t.Optional[int]:
+    return getattr(settings, 'DAD_MAX_EVENT_AGE', DEFAULT_MAX_EVENT_AGE).get(destination)
+
+
+def stale_q(destination: str, at: datetime.datetime) -> t.Optional[Q]:
+    """
+    Condition of events too old for `destination`, by DAD_MAX_EVENT_AGE and `EventType.max_age`.
+    None if no limit applies to the destination.
+    """
+    conditions = []
+    max_age = get_max_age(destination)
+    if max_age is not None:
+        conditions.append(Q(timestamp__lt=at - datetime.timedelta(seconds=max_age)))
+    for event_type in getattr(settings, 'EVENT_TYPES', ()):
+        if event_type.max_age is None or (max_age is not None and event_type.max_age >= max_age):
+            continue
+        conditions.append(Q(event_type=event_type.name,
+                            timestamp__lt=at - datetime.timedelta(seconds=event_type.max_age)))
+    if not conditions:
+        return None
+    return functools.reduce(operator.or_, conditions)
+
+
+def expire_stale(destination: str, shard: t.Optional[t.Tuple[int, int]] = None) -> int:
+    """
+    Mark pending events too old for `destination` as EXPIRED with one UPDATE, return their number.
+    """
+    at = now()
+    condition = stale_q(destination, at)
+    if condition is None:
+        return 0
+    queryset = EventToDispatch.objects.filter(pending_q(destination), condition)
+    if shard is not None:
+        queryset = sharding.filter_shard(queryset, shard)
+    expired = queryset.update(**{'sent_' + destination: at, 'status_' + destination: DeliveryStatus.EXPIRED})
+    if expired:
+        logger.info('%d events expired for %s', expired, destination)
+    return expired
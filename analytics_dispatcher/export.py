@@ -0,0 +1,158 @@
+import datetime
+import gzip
+import logging
+import os
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+from . import requeue, serialization
+from .models import DESTINATIONS, EventToDispatch
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('ndjson', 'parquet')
+JSON_FIELDS = ('user_snapshot', 'session_data', 'user_properties', 'event_properties')
+FIELDS = ('id', 'event_type', 'timestamp', 'user_id') + JSON_FIELDS + tuple(
+    field for destination in DESTINATIONS
+    for field in ('send_' + destination, 'sent_' + destination, 'status_' + destination))
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def _ndjson_row(row: dict) -> dict:
+    for name, value in row.items():
+        if isinstance(value, datetime.datetime):
+            row[name] = value.isoformat()
+    return row
+
+
+def write_ndjson(rows: t.Iterable[dict], path: str) -> int:
+    """
+    Write gzip compressed NDJSON, one event per line.
+    """
+    count = 0
+    with gzip.open(path, 'wb') as f:
+        for row in rows:
+            f.write(serialization.dumps(_ndjson_row(row)))
+            f.write(b'\n')
+            count += 1
+    return count
+
+
+def parquet_schema():
+    fields = []
+    for name in FIELDS:
+        if name in ('id', 'user_id'):
+            type_ = pyarrow.int64()
+        elif name == 'timestamp' or name.startswith('sent_'):
+            type_ = pyarrow.timestamp('us', tz='UTC')
+        elif name.startswith('send_'):
+            type_ = pyarrow.bool_()
+        elif name.startswith('status_'):
+            type_ = pyarrow.int16()
+        else:
+            # JSON columns are stored as JSON text
+            type_ = pyarrow.string()
+        fields.append((name, type_))
+    return pyarrow.schema(fields)
+
+
+def write_parquet(rows: t.Iterable[dict], path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """
+    Write Parquet with a row group per `chunk_size` events, requires pyarrow.
+    """
+    schema = parquet_schema()
+    count = 0
+    with pyarrow.parquet.ParquetWriter(path, schema, compression='zstd') as writer:
+        chunk = []
+        for row in rows:
+            for name in JSON_FIELDS:
+                if row[name] is not None:
+                    row[name] = serialization.dumps(row[name]).decode()
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                writer.write_table(pyarrow.Table.from_pylist(chunk, schema=schema))
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            writer.write_table(pyarrow.Table.from_pylist(chunk, schema=schema))
+            count += len(chunk)
+    return count
+
+
+def iter_rows(queryset, chunk_size: int = DEFAULT_CHUNK_SIZE) -> t.Iterator[dict]:
+    """
+    Stream rows as dicts, over a server-side cursor where the database supports it.
+    """
+    for row in queryset.values(*FIELDS, 'session__data').order_by('pk').iterator(chunk_size=chunk_size):
+        session_data = row.pop('session__data')
+        if session_data is not None:
+            row['session_data'] = session_data
+        yield row
+
+
+def split_pk_range(queryset, parts: int) -> t.List[t.Tuple[int, int]]:
+    """
+    Split pks of the queryset into at most `parts` ranges [first, last] of equal width.
+    """
+    first, last = requeue.pk_bounds(queryset)
+    if first is None:
+        return []
+    step = -(-(last - first + 1) // parts)
+    return [(low, min(low + step - 1, last)) for low in range(first, last + 1, step)]
+
+
+def part_path(path: str, part: int) -> str:
+    directory, name = os.path.split(path)
+    stem, dot, suffix = name.partition('.')
+    return os.path.join(directory, f'{stem}-{part:03d}{dot}{suffix}')
+
+
+def export(queryset, path: str, fmt: str = 'ndjson', chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    rows = iter_rows(queryset, chunk_size)
+    if fmt == 'parquet':
+        return write_parquet(rows, path, chunk_size)
+    return write_ndjson(rows, path)
+
+
+def _export_part(queryset, path: str, fmt: str, chunk_size: int) -> int:
+    try:
+        return export(queryset, path, fmt, chunk_size)
+    finally:
+        connections.close_all()
+
+
+def export_parallel(queryset, path: str, jobs: int, fmt: str = 'ndjson',
+                    chunk_size: int = DEFAULT_CHUNK_SIZE) -> t.List[t.Tuple[str, int]]:
+    """
+    Export `jobs` pk ranges concurrently, each into its own file `<name>-NNN.<ext>`.
+    """
+    ranges = split_pk_range(queryset, jobs)
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='dad-export') as executor:
+        futures = [
+            (part_path(path, i), executor.submit(_export_part,
+                                                 queryset.filter(pk__gte=first, pk__lte=last),
+                                                 part_path(path, i), fmt, chunk_size))
+            for i, (first, last) in enumerate(ranges)
+        ]
+        return [(part, future.result()) for part, future in futures]
+
+
+def filter_events(since: t.Optional[datetime.datetime] = None, until: t.Optional[datetime.datetime] = None,
+                  event_types: t.Optional[t.List[str]] = None, filters: t.Iterable = ()):
+    queryset = EventToDispatch.objects.all()
+    if since is not None:
+        queryset = queryset.filter(timestamp__gte=since)
+    if until is not None:
+        queryset = queryset.filter(timestamp__lt=until)
+    if event_types:
+        queryset = queryset.filter(event_type__in=event_types)
+    for q in filters:
+        queryset = queryset.filter(q)
+    return queryset
@@ -0,0 +1,123 @@
+import functools
+import logging
+import operator
+import typing as t
+
+from . import batching, circuit, leasing, profiling, sharding
+from .clients._base import AnalyticsBackend
+from .models import EventToDispatch, pending_q
+
+logger = logging.getLogger(__name__)
+
+# lease and batching name of the fan-out pass
+NAME = leasing.FANOUT
+
+
+def is_pending(event: EventToDispatch, destination: str) -> bool:
+    return getattr(event, 'send_' + destination) and getattr(event, 'sent_' + destination) is None
+
+
+def pending_events(destinations: t.Iterable[str], shard: t.Optional[t.Tuple[int, int]] = None):
+    queryset = EventToDispatch.objects.filter(functools.reduce(operator.or_, (pending_q(d) for d in destinations)))
+    if shard is not None:
+        queryset = sharding.filter_shard(queryset, shard)
+    return queryset
+
+
+class Fanout:
+    """
+    Dispatch to all backends from one scan of the queue: a batch of rows pending for any destination is claimed
+    once, every backend gets its pending part of the batch and all status columns are written by one update.
+    Destinations which paused or failed are skipped for the rest of the run, destinations with open circuit
+    breaker are skipped entirely and a half-open one gets single probe events until one reaches the destination.
+    """
+
+    def __init__(self, backends: t.Dict[str, AnalyticsBackend], capture_exception: t.Optional[t.Callable] = None):
+        self.backends = backends
+        self.capture_exception = capture_exception
+        self.paused = set()
+        self.probes = set()
+        self.breakers = {}
+        for name in backends:
+            breaker = self.breakers[name] = circuit.get_breaker(name)
+            state = breaker.acquire()
+            if state == circuit.OPEN:
+                logger.info('%s circuit is open, skipped', name)
+                self.paused.add(name)
+            elif state == circuit.HALF_OPEN:
+                self.probes.add(name)
+
+    def active(self) -> t.List[str]:
+        return [name for name in self.backends if name not in self.paused]
+
+    def release_probes(self):
+        """
+        Let other workers probe destinations which had no event to send in this run.
+        """
+        for name in self.probes:
+            self.breakers[name].release_probe()
+        self.probes.clear()
+
+    def pending_events(self, shard: t.Optional[t.Tuple[int, int]] = None):
+        return pending_events(self.active(), shard)
+
+    def process_batch(self, number: int = 100, shard: t.Optional[t.Tuple[int, int]] = None,
+                      stats: t.Optional[batching.BatchStats] = None) -> int:
+        if stats is None:
+            stats = batching.BatchStats()
+        destinations = self.active()
+        if not destinations:
+            stats.paused = True
+            return 0
+
+        with profiling.stage('claim'):
+            # conflicts with leases of any destination
+            token, events = leasing.claim(pending_events(destinations, shard), NAME, number)
+        if len(events) == 0:
+            return 0
+
+        update_fields = []
+        try:
+            for name in destinations:
+                backend = self.backends[name]
+                pending = [event for event in events if is_pending(event, name)]
+                if not pending:
+                    continue
+                if name in self.probes:
+                    pending = pending[:1]
+                backend_stats = batching.BatchStats()
+                try:
+                    processed = backend.send_batch(pending, backend_stats)
+                except Exception as e:
+                    if self.capture_exception:
+                        self.capture_exception()
+                    logger.error("Error on submitting events to %s: %s", name, str(e))
+                    self.breakers[name].record_failure()
+                    self.paused.add(name)
+                    self.probes.discard(name)
+                    stats.errors += len(pending)
+                    # events delivered before the failure keep their status
+                    update_fields.extend(backend.status_fields())
+                    continue
+                if backend_stats.paused:
+                    # throttling is not a success, a destination which keeps pausing opens the circuit
+                    logger.info('%s paused, skipped for the rest of the run', name)
+                    self.breakers[name].record_failure()
+                    self.paused.add(name)
+                    self.probes.discard(name)
+                elif len(processed) > backend_stats.skipped:
+                    if name in self.probes:
+                        logger.info('%s probe succeeded', name)
+                    self.breakers[name].record_success()
+                    self.probes.discard(name)
+                stats.errors += backend_stats.errors
+                if processed:
+                    logger.info('sent %d events to %s', len(processed), name)
+                    update_fields.extend(backend.status_fields())
+        finally:
+            with profiling.stage('status'):
+                leasing.release(token, events, update_fields)
+
+        if len(self.paused) == len(self.backends):
+            stats.paused = True
+        return len(events)
@@ -0,0 +1,62 @@
+import hashlib
+import threading
+import time
+import typing as t
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import EventToDispatch
+
+DEFAULT_WINDOW = 24 * 60 * 60
+DEFAULT_CACHE_SIZE = 10000
+
+
+def get_window() -> int:
+    return getattr(settings, 'DAD_IDEMPOTENCY_WINDOW', DEFAULT_WINDOW)
+
+
+def make_keys(event_name: str, idempotency_key: str) -> t.Tuple[str, str]:
+    """
+    Values of `EventToDispatch.idempotency_key` in the current and the previous time window. The key includes
+    the number of the window, so the unique index rejects duplicates within the current window only and
+    a retry crossing the window boundary is found by the previous key.
+    """
+    window = get_window()
+    number = int(time.time() // window)
+    digest = hashlib.sha224(f'{event_name}:{idempotency_key}'.encode()).hexdigest()
+    return f'{number}:{digest}', f'{number - 1}:{digest}'
+
+
+def is_duplicate(key: str, previous_key: str) -> bool:
+    """
+    Whether an event with the key was seen recently or stored in the previous window.
+    """
+    if recent_keys.seen(key) or recent_keys.seen(previous_key):
+        return True
+    return EventToDispatch.objects.filter(idempotency_key=previous_key).exists()
+
+
+class RecentKeys:
+    """
+    In-process filter of recently seen keys, it saves a failing INSERT for repeated duplicates.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, key: str) -> bool:
+        with self._lock:
+            return key in self._keys
+
+    def add(self, key: str):
+        with self._lock:
+            self._keys[key] = None
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+
+
+recent_keys = RecentKeys(getattr(settings, 'DAD_IDEMPOTENCY_CACHE_SIZE', DEFAULT_CACHE_SIZE))
@@ -0,0 +1,83 @@
+import logging
+import os
+import threading
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 100
+# dispatch lane of instant events, the regular dispatch sends them first if the background send is lost
+DEFAULT_PRIORITY = 100
+
+
+def get_priority() -> int:
+    return getattr(settings, 'DAD_INSTANT_SEND_PRIORITY', DEFAULT_PRIORITY)
+
+
+class BoundedExecutor:
+    """
+    Thread pool which refuses tasks instead of queueing them without limit.
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dad-instant')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def submit(self, fn: t.Callable, *args) -> bool:
+        if not self._slots.acquire(blocking=False):
+            return False
+        try:
+            self._executor.submit(self._run, fn, *args)
+        except RuntimeError:
+            # interpreter shutdown
+            self._slots.release()
+            return False
+        return True
+
+    def _run(self, fn: t.Callable, *args):
+        try:
+            fn(*args)
+        except Exception:
+            logger.exception('instant send failed')
+        finally:
+            # connections of pool threads are not closed by request_finished
+            connections.close_all()
+            self._slots.release()
+
+
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+
+
+def get_executor() -> t.Optional[BoundedExecutor]:
+    """
+    Per process executor of instant sends, None if DAD_INSTANT_SEND_WORKERS = 0.
+    """
+    global _executor, _executor_pid
+    workers = getattr(settings, 'DAD_INSTANT_SEND_WORKERS', DEFAULT_WORKERS)
+    if not workers:
+        return None
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = BoundedExecutor(workers, getattr(settings, 'DAD_INSTANT_SEND_QUEUE_SIZE',
+                                                             DEFAULT_QUEUE_SIZE))
+                _executor_pid = pid
+    return _executor
+
+
+def submit(fn: t.Callable, *args) -> bool:
+    """
+    Run `fn(*args)` in background, return False if instant sends are disabled or the executor is full.
+    """
+    executor = get_executor()
+    if executor is None:
+        return False
+    return executor.submit(fn, *args)
@@ -0,0 +1,129 @@
+import datetime
+import logging
+import typing as t
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils.timezone import now
+
+from . import instant, profiling, routers, sharding
+from .models import EventLease, EventToDispatch
+
+logger = logging.getLogger(__name__)
+
+# seconds, has to cover the slowest batch send including retries
+DEFAULT_TTL = 300
+# lease name of the fan-out pass, excludes the event from per-destination passes
+FANOUT = 'fanout'
+# share of a batch given to the oldest events of lower priority lanes
+DEFAULT_PRIORITY_FAIRNESS = 0.1
+
+
+def get_ttl() -> int:
+    return getattr(settings, 'DAD_EVENT_LEASE_TTL', DEFAULT_TTL)
+
+
+def get_lanes() -> t.List[int]:
+    """
+    Configured priorities of `EVENT_TYPES` and the priority of instant events, highest first.
+    """
+    lanes = {event_type.priority for event_type in getattr(settings, 'EVENT_TYPES', ())}
+    lanes.add(instant.get_priority())
+    return sorted(lanes, reverse=True)
+
+
+def select_events(queryset, number: int) -> t.List[EventToDispatch]:
+    """
+    Lock up to `number` events, higher priority lanes first. A `DAD_PRIORITY_FAIRNESS` share of the batch
+    goes to the oldest events of lower lanes so they are not starved by a busy higher lane.
+    """
+    queryset = queryset.select_for_update(skip_locked=True)
+    lanes = get_lanes()
+    fair = 0
+    if len(lanes) > 1:
+        fair = int(number * getattr(settings, 'DAD_PRIORITY_FAIRNESS', DEFAULT_PRIORITY_FAIRNESS))
+    events = list(queryset.order_by('-priority', 'timestamp')[:number - fair])
+    if fair == 0 or len(events) < number - fair:
+        return events
+    claimed = [event.pk for event in events]
+    # a query per lane is served by the (-priority, timestamp) pending indexes
+    candidates = [event for lane in lanes[1:]
+                  for event in queryset.filter(priority=lane).exclude(pk__in=claimed).order_by('timestamp')[:fair]]
+    candidates.sort(key=lambda event: event.timestamp)
+    return events + candidates[:fair]
+
+
+def make_token() -> str:
+    """
+    Id of a single claim, leases of a batch are found and released by it.
+    """
+    return f'{sharding.default_worker_id()}:{uuid.uuid4().hex[:12]}'
+
+
+def claim(queryset, name: str, number: int,
+          conflicting: t.Optional[t.Iterable[str]] = None) -> t.Tuple[str, t.List[EventToDispatch]]:
+    """
+    Lease up to `number` events of `queryset` under `name` in a short transaction.
+
+    Events with an unexpired lease of a `conflicting` name (of any name if None) are skipped, expired leases
+    of `name` are replaced. Returns the claim token and the leased events, the transaction is committed
+    when this returns so the events can be sent without holding locks.
+    """
+    token = make_token()
+    at = now()
+    active = EventLease.objects.filter(event=OuterRef('pk'), expires_at__gt=at)
+    if conflicting is not None:
+        active = active.filter(destination__in=list(conflicting))
+    with transaction.atomic(using=routers.get_database()):
+        EventLease.objects.filter(destination=name, expires_at__lte=at).delete()
+        events = select_events(queryset.filter(~Exists(active)), number)
+        if not events:
+            return token, []
+        expires_at = at + datetime.timedelta(seconds=get_ttl())
+        # a row leased by a concurrent claim committed after our snapshot conflicts and is dropped
+        EventLease.objects.bulk_create([EventLease(event_id=event.pk, destination=name, worker_id=token,
+                                                   expires_at=expires_at) for event in events],
+                                       ignore_conflicts=True)
+        leased = set(EventLease.objects.filter(worker_id=token).values_list('event_id', flat=True))
+    if len(leased) < len(events):
+        logger.info('%d events of %s already leased', len(events) - len(leased), name)
+        events = [event for event in events if event.pk in leased]
+    return token, events
+
+
+def release(token: str, events: t.List[EventToDispatch], fields: t.List[str]) -> None:
+    """
+    Save `fields` of processed `events` and drop the leases of claim `token` in a short transaction.
+    """
+    with transaction.atomic(using=routers.get_database()):
+        if events and fields:
+            EventToDispatch.objects.bulk_update(events, fields)
+        EventLease.objects.filter(worker_id=token).delete()
+
+
+def process_batch(backend, queryset, number: int, stats) -> int:
+    """
+    Claim a batch of `backend` events, send it outside of any transaction and save the results.
+    """
+    name = backend.SERVICE_NAME
+    with profiling.stage('claim'):
+        token, events = claim(queryset, name, number, conflicting=(name, FANOUT))
+    if not events:
+        return 0
+    processed = []
+    try:
+        processed = backend.send_batch(events, stats)
+    except Exception:
+        # events delivered before the failure keep their status
+        processed = [event for event in events if getattr(event, 'sent_' + name) is not None]
+        raise
+    finally:
+        with profiling.stage('status'):
+            release(token, processed, backend.status_fields())
+    return len(processed)
+
+
+def cleanup_expired() -> int:
+    return EventLease.objects.filter(expires_at__lte=now()).delete()[0]
@@ -0,0 +1,53 @@
+import datetime
+import json
+from argparse import ArgumentParser
+
+from django.core.management import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.timezone import now
+
+from analytics_dispatcher import reporting
+from analytics_dispatcher.management.utils import parse_time
+from analytics_dispatcher.models import DESTINATIONS
+
+
+def _format_seconds(value, exact: bool) -> str:
+    if value is None:
+        return f'>{reporting.BUCKETS[-1]}s'
+    return f'{value:.1f}s' if exact else f'<={value}s'
+
+
+class Command(BaseCommand):
+    help = 'Delivery latency percentiles and backlog of destinations over a time range'
+
+    def add_arguments(self, parser: ArgumentParser):
+        parser.add_argument('--since', type=parse_time, default=None, help='default is a day before --until')
+        parser.add_argument('--until', type=parse_time, default=None, help='default is now')
+        parser.add_argument('--destination', action='append', default=[], choices=DESTINATIONS,
+                            help='may be repeated, default is all')
+        parser.add_argument('--event-type', action='append', default=[], help='may be repeated')
+        parser.add_argument('--points', type=int, default=reporting.DEFAULT_POINTS,
+                            help='number of backlog samples')
+        parser.add_argument('--format', choices=('text', 'json'), default='text')
+
+    def handle(self, *args, **options):
+        until = options['until'] or now()
+        since = options['since'] or until - datetime.timedelta(days=1)
+        result = reporting.report(options['destination'] or list(DESTINATIONS), since, until, options['points'],
+                                  options['event_type'])
+        if options['format'] == 'json':
+            self.stdout.write(json.dumps(result, cls=DjangoJSONEncoder, indent=2))
+            return
+
+        exact = reporting.has_percentiles(reporting.delivered(DESTINATIONS[0], since, until))
+        self.stdout.write(f'Latency of events delivered from {since.isoformat()} to {until.isoformat()}')
+        for row in result['latency']:
+            percentiles = ' '.join(f'{reporting.percentile_key(fraction)} '
+                                   f'{_format_seconds(row[reporting.percentile_key(fraction)], exact)}'
+                                   for fraction in reporting.PERCENTILES)
+            self.stdout.write(f'  {row["destination"]:<14} {row["event_type"]:<30} {row["count"]:>9}  {percentiles}')
+        self.stdout.write('Backlog')
+        for destination, points in result['backlog'].items():
+            self.stdout.write(f'  {destination}')
+            for moment, count in points:
+                self.stdout.write(f'    {moment.isoformat()} {count:>9}')
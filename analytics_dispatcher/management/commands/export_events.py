@@ -0,0 +1,45 @@
+from argparse import ArgumentParser
+
+from django.core.management import BaseCommand, CommandError
+from django.db.models import Q
+
+from analytics_dispatcher import export
+from analytics_dispatcher.management.utils import parse_time
+from analytics_dispatcher.models import DESTINATIONS, DeliveryStatus, errors_q, pending_q
+
+
+class Command(BaseCommand):
+    help = 'Export events to gzip compressed NDJSON or Parquet'
+
+    def add_arguments(self, parser: ArgumentParser):
+        parser.add_argument('output', help='file name, with --jobs a part number is added to it')
+        parser.add_argument('--format', choices=export.FORMATS, default='ndjson')
+        parser.add_argument('--since', type=parse_time, default=None, help='timestamp >= since')
+        parser.add_argument('--until', type=parse_time, default=None, help='timestamp < until')
+        parser.add_argument('--event-type', action='append', default=[], help='may be repeated')
+        parser.add_argument('--pending', action='append', default=[], choices=DESTINATIONS,
+                            help='only events pending for the destination, may be repeated')
+        parser.add_argument('--errors', action='append', default=[], choices=DESTINATIONS,
+                            help='only events failed for the destination, may be repeated')
+        parser.add_argument('--sent', action='append', default=[], choices=DESTINATIONS,
+                            help='only events delivered to the destination, may be repeated')
+        parser.add_argument('--chunk-size', type=int, default=export.DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--jobs', type=int, default=1, help='export this number of pk ranges in parallel')
+
+    def handle(self, *args, **options):
+        if options['format'] == 'parquet' and export.pyarrow is None:
+            raise CommandError('Parquet export requires pyarrow, install django-analytics-dispatcher[parquet]')
+
+        filters = [pending_q(destination) for destination in options['pending']]
+        filters += [errors_q(destination) for destination in options['errors']]
+        filters += [Q(**{'status_' + destination: DeliveryStatus.OK}) for destination in options['sent']]
+        queryset = export.filter_events(options['since'], options['until'], options['event_type'], filters)
+
+        if options['jobs'] > 1:
+            parts = export.export_parallel(queryset, options['output'], options['jobs'], options['format'],
+                                           options['chunk_size'])
+        else:
+            parts = [(options['output'],
+                      export.export(queryset, options['output'], options['format'], options['chunk_size']))]
+        for path, count in parts:
+            self.stdout.write(f'{path}: {count} events')
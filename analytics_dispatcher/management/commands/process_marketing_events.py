@@ -2,13 +2,26 @@ from argparse import ArgumentParser
 
 from django.core.management import BaseCommand
 
-from analytics_dispatcher.event import process_event_queue
+from analytics_dispatcher import sharding
+from analytics_dispatcher.event import process_event_queue, process_event_queue_sharded
 
 
 class Command(BaseCommand):
     def add_arguments(self, parser: ArgumentParser):
         parser.add_argument('--clean', default=False, action='store_true')
+        parser.add_argument('--shards', type=int, default=sharding.get_shard_count(),
+                            help='run as one of parallel workers, queue is split into this number of user shards, '
+                                 'default is DAD_SHARD_COUNT')
+        parser.add_argument('--worker-id', default=None, help='unique worker name, default is host:pid')
+        parser.add_argument('--lease-ttl', type=int, default=sharding.DEFAULT_LEASE_TTL,
+                            help='seconds after which shards of a dead worker are taken over')
+        parser.add_argument('--fanout', default=None, action='store_true',
+                            help='read the queue once for all destinations, default is DAD_FANOUT')
 
     def handle(self, *args, **options):
-        process_event_queue(clean=options['clean'])
-        pass
+        if options['shards'] > 0:
+            process_event_queue_sharded(options['shards'], worker_id=options['worker_id'],
+                                        lease_ttl=options['lease_ttl'], clean=options['clean'],
+                                        fanout_mode=options['fanout'])
+        else:
+            process_event_queue(clean=options['clean'], fanout_mode=options['fanout'])
@@ -0,0 +1,57 @@
+from argparse import ArgumentParser
+
+from django.core.management import BaseCommand
+
+from analytics_dispatcher import requeue
+from analytics_dispatcher.management.utils import parse_time
+from analytics_dispatcher.models import DESTINATIONS
+
+
+class Command(BaseCommand):
+    help = 'Send events to a destination again, in pk range chunks'
+
+    def add_arguments(self, parser: ArgumentParser):
+        parser.add_argument('destination', choices=DESTINATIONS)
+        parser.add_argument('--since', type=parse_time, default=None, help='timestamp >= since')
+        parser.add_argument('--until', type=parse_time, default=None, help='timestamp < until')
+        parser.add_argument('--event-type', action='append', default=[], help='may be repeated')
+        parser.add_argument('--errors-only', default=False, action='store_true',
+                            help='requeue only events failed for the destination with ERROR or REJECTED')
+        parser.add_argument('--new-destination', default=False, action='store_true',
+                            help='send all events to the destination, also of event types not sent to it')
+        parser.add_argument('--chunk-size', type=int, default=requeue.DEFAULT_CHUNK_SIZE,
+                            help='pks updated by one statement')
+        parser.add_argument('--sleep', type=float, default=0.5, help='seconds between chunks')
+        parser.add_argument('--max-pending', type=int, default=None,
+                            help='wait while the destination has this number of pending events')
+        parser.add_argument('--start-pk', type=int, default=None, help='resume from this pk')
+        parser.add_argument('--end-pk', type=int, default=None)
+        parser.add_argument('--dry-run', default=False, action='store_true')
+
+    def handle(self, *args, **options):
+        destination = options['destination']
+        queryset = requeue.filter_events(destination, options['since'], options['until'], options['event_type'],
+                                         options['errors_only'], options['new_destination'])
+        start_pk, end_pk = options['start_pk'], options['end_pk']
+        if start_pk is None or end_pk is None:
+            first, last = requeue.pk_bounds(queryset)
+            if first is None:
+                self.stdout.write('No events to requeue')
+                return
+            start_pk = first if start_pk is None else start_pk
+            end_pk = last if end_pk is None else end_pk
+
+        if options['dry_run']:
+            count = queryset.filter(pk__gte=start_pk, pk__lte=end_pk).count()
+            self.stdout.write(f'{count} events with pk {start_pk}-{end_pk} would be requeued to {destination}')
+            return
+
+        total = 0
+        for low, high, count in requeue.requeue_chunks(queryset, destination, start_pk, end_pk,
+                                                       options['chunk_size'], options['sleep'],
+                                                       options['max_pending']):
+            total += count
+            done = (high - start_pk + 1) * 100 // (end_pk - start_pk + 1)
+            self.stdout.write(f'pk {low}-{high}: {count} requeued, {total} total, {done}%, '
+                              f'resume with --start-pk {high + 1}')
+        self.stdout.write(f'{total} events requeued to {destination}')
@@ -0,0 +1,24 @@
+import argparse
+import datetime
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+
+def parse_time(value: str) -> datetime.datetime:
+    """
+    Aware datetime of a command line argument, a date means its midnight in the current time zone.
+    Used as argparse `type`, bad values are reported as usage errors.
+    """
+    try:
+        parsed = parse_datetime(value) or parse_date(value)
+    except ValueError:
+        # well formed, but not a valid date, e.g. 2024-02-30
+        parsed = None
+    if parsed is None:
+        raise argparse.ArgumentTypeError(f'Bad date "{value}", use YYYY-MM-DD or ISO 8601 date and time')
+    if not isinstance(parsed, datetime.datetime):
+        parsed = datetime.datetime.combine(parsed, datetime.time())
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
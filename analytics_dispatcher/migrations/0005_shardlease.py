@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_dispatcher', '0004_auto_20220717_1045'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardLease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('destination', models.CharField(max_length=32)),
+                ('shard', models.PositiveIntegerField()),
+                ('owner', models.CharField(blank=True, max_length=255, null=True)),
+                ('expires_at', models.DateTimeField()),
+            ],
+            options={
+                'unique_together': {('destination', 'shard')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_dispatcher', '0005_shardlease'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='eventtodispatch',
+            name='event_type',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_dispatcher', '0006_eventtodispatch_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventtodispatch',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=80, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='eventtodispatch',
+            constraint=models.UniqueConstraint(condition=models.Q(('idempotency_key__isnull', False)), fields=('idempotency_key',), name='dad_idempotency_key_uniq'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_dispatcher', '0007_eventtodispatch_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventtodispatch',
+            name='rollup_key',
+            field=models.CharField(blank=True, max_length=56, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='eventtodispatch',
+            index=models.Index(condition=models.Q(('rollup_key__isnull', False)), fields=['rollup_key', 'timestamp'], name='dad_rollup_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:27
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_dispatcher', '0008_eventtodispatch_rollup_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventtodispatch',
+            name='user_snapshot',
+            field=models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_dispatcher', '0009_eventtodispatch_user_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SessionInfo',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(max_length=56, unique=True)),
+                ('data', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='eventtodispatch',
+            name='session',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='events', to='analytics_dispatcher.sessioninfo'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+DESTINATIONS = ('amplitude', 'intercom', 'user_dot_com', 'mix_panel', 'ga4')
+STATUS_CHOICES = [(1, 'ok'), (2, 'error'), (3, 'user missing'), (4, 'rejected')]
+
+
+class Migration(migrations.Migration):
+    """
+    First step of the text status to code conversion: new nullable columns, filled by 0012_status_codes_backfill.
+    """
+
+    dependencies = [
+        ('analytics_dispatcher', '0010_sessioninfo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryError',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('destination', models.CharField(max_length=32)),
+                ('status', models.PositiveSmallIntegerField(choices=STATUS_CHOICES)),
+                ('message', models.TextField(blank=True)),
+                # auto_now_add is set after the data is copied
+                ('created_at', models.DateTimeField(db_index=True, null=True)),
+                ('event', models.ForeignKey(db_constraint=False,
+                                            on_delete=django.db.models.deletion.DO_NOTHING,
+                                            related_name='delivery_errors',
+                                            to='analytics_dispatcher.eventtodispatch')),
+            ],
+        ),
+    ] + [
+        migrations.AddField(
+            model_name='eventtodispatch',
+            name='status_code_' + destination,
+            field=models.PositiveSmallIntegerField(choices=STATUS_CHOICES, null=True),
+        ) for destination in DESTINATIONS
+    ]
@@ -0,0 +1,83 @@
+from django.db import migrations, models, transaction
+
+DESTINATIONS = ('amplitude', 'intercom', 'user_dot_com', 'mix_panel', 'ga4')
+OK, ERROR, USER_MISSING, REJECTED = 1, 2, 3, 4
+USER_MISSING_TEXT = 'error: user missed'
+CHUNK_SIZE = 5000
+# max_length of the text status columns
+STATUS_LENGTH = 256
+
+
+def pk_chunks(events):
+    bounds = events.aggregate(first=models.Min('pk'), last=models.Max('pk'))
+    if bounds['first'] is None:
+        return
+    for low in range(bounds['first'], bounds['last'] + 1, CHUNK_SIZE):
+        yield events.filter(pk__gte=low, pk__lt=low + CHUNK_SIZE)
+
+
+def status_to_code(apps, schema_editor):
+    """
+    Convert statuses by pk ranges, a transaction per range. Converted rows are skipped, so an interrupted
+    migration continues where it stopped.
+    """
+    alias = schema_editor.connection.alias
+    EventToDispatch = apps.get_model('analytics_dispatcher', 'EventToDispatch')
+    DeliveryError = apps.get_model('analytics_dispatcher', 'DeliveryError')
+    for chunk in pk_chunks(EventToDispatch.objects.using(alias)):
+        with transaction.atomic(using=alias):
+            for destination in DESTINATIONS:
+                status, code = 'status_' + destination, 'status_code_' + destination
+                events = chunk.filter(**{status + '__isnull': False, code + '__isnull': True})
+                failed = (events.exclude(**{status + '__in': ('ok', USER_MISSING_TEXT)})
+                          .values_list('pk', status, 'sent_' + destination))
+                DeliveryError.objects.using(alias).bulk_create([
+                    # amplitude rejections are stored as "<error map name>{...}"
+                    DeliveryError(event_id=pk, destination=destination, message=message, created_at=sent,
+                                  status=REJECTED if message.startswith('events_') else ERROR)
+                    for pk, message, sent in failed
+                ])
+                events.filter(**{status: 'ok'}).update(**{code: OK})
+                events.filter(**{status: USER_MISSING_TEXT}).update(**{code: USER_MISSING})
+                events.filter(**{status + '__startswith': 'events_'}).update(**{code: REJECTED})
+                events.update(**{code: ERROR})
+    DeliveryError.objects.using(alias).filter(created_at__isnull=True).update(created_at=models.functions.Now())
+
+
+def code_to_status(apps, schema_editor):
+    """
+    Restore the text statuses from codes, failures get the latest `DeliveryError` message.
+    """
+    alias = schema_editor.connection.alias
+    EventToDispatch = apps.get_model('analytics_dispatcher', 'EventToDispatch')
+    DeliveryError = apps.get_model('analytics_dispatcher', 'DeliveryError')
+    for chunk in pk_chunks(EventToDispatch.objects.using(alias)):
+        with transaction.atomic(using=alias):
+            for destination in DESTINATIONS:
+                status, code = 'status_' + destination, 'status_code_' + destination
+                chunk.filter(**{code: OK}).update(**{status: 'ok'})
+                chunk.filter(**{code: USER_MISSING}).update(**{status: USER_MISSING_TEXT})
+                # the latest error message of the event, cut to the length of the text column
+                message = (DeliveryError.objects.using(alias)
+                           .filter(event_id=models.OuterRef('pk'), destination=destination)
+                           .order_by('-created_at', '-pk').values('message')[:1])
+                failed = chunk.filter(**{code + '__in': (ERROR, REJECTED)})
+                failed.update(**{status: models.functions.Substr(
+                    models.Subquery(message, output_field=models.TextField()), 1, STATUS_LENGTH)})
+                failed.filter(models.Q(**{status + '__isnull': True}) | models.Q(**{status: ''})).update(
+                    **{status: 'error'})
+
+
+class Migration(migrations.Migration):
+    """
+    Second step: fill status codes and `DeliveryError` in short transactions, rows stay writable meanwhile.
+    """
+    atomic = False
+
+    dependencies = [
+        ('analytics_dispatcher', '0011_status_codes'),
+    ]
+
+    operations = [
+        migrations.RunPython(status_to_code, code_to_status, atomic=False),
+    ]
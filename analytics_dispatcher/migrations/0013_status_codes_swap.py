@@ -0,0 +1,50 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import connections, migrations, models
+
+from analytics_dispatcher import routers
+
+DESTINATIONS = ('amplitude', 'intercom', 'user_dot_com', 'mix_panel', 'ga4')
+ERROR, REJECTED = 2, 4
+# CREATE INDEX CONCURRENTLY is PostgreSQL only
+AddIndex = AddIndexConcurrently if connections[routers.get_database()].vendor == 'postgresql' else migrations.AddIndex
+
+
+class Migration(migrations.Migration):
+    """
+    Last step: the code columns replace the text ones, the errors index is built without blocking writes.
+    """
+    # CREATE INDEX CONCURRENTLY can not run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('analytics_dispatcher', '0012_status_codes_backfill'),
+    ]
+
+    operations = [
+        operation for destination in DESTINATIONS for operation in (
+            migrations.RemoveField(
+                model_name='eventtodispatch',
+                name='status_' + destination,
+            ),
+            migrations.RenameField(
+                model_name='eventtodispatch',
+                old_name='status_code_' + destination,
+                new_name='status_' + destination,
+            ),
+        )
+    ] + [
+        migrations.AlterField(
+            model_name='deliveryerror',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        AddIndex(
+            model_name='eventtodispatch',
+            index=models.Index(condition=models.Q(('status_amplitude__in', (ERROR, REJECTED)),
+                                                  ('status_intercom__in', (ERROR, REJECTED)),
+                                                  ('status_user_dot_com__in', (ERROR, REJECTED)),
+                                                  ('status_mix_panel__in', (ERROR, REJECTED)),
+                                                  ('status_ga4__in', (ERROR, REJECTED)), _connector='OR'),
+                               fields=['timestamp'], name='dad_errors_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('analytics_dispatcher', '0013_status_codes_swap'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='eventtodispatch',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_dispatcher', '0014_eventtodispatch_user_no_constraint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventLease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('destination', models.CharField(max_length=32)),
+                ('worker_id', models.CharField(db_index=True, max_length=255)),
+                ('expires_at', models.DateTimeField()),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leases', to='analytics_dispatcher.eventtodispatch')),
+            ],
+            options={
+                'unique_together': {('event', 'destination')},
+            },
+        ),
+    ]
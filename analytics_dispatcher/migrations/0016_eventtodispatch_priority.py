@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:42
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import connections, migrations, models
+
+from analytics_dispatcher import routers
+
+# CREATE INDEX CONCURRENTLY is PostgreSQL only
+AddIndex = AddIndexConcurrently if connections[routers.get_database()].vendor == 'postgresql' else migrations.AddIndex
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can not run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('analytics_dispatcher', '0015_eventlease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventtodispatch',
+            name='priority',
+            field=models.SmallIntegerField(default=0),
+        ),
+        AddIndex(
+            model_name='eventtodispatch',
+            index=models.Index(condition=models.Q(('send_amplitude', True), ('sent_amplitude', None)), fields=['-priority', 'timestamp'], name='dad_pending_amplitude_idx'),
+        ),
+        AddIndex(
+            model_name='eventtodispatch',
+            index=models.Index(condition=models.Q(('send_intercom', True), ('sent_intercom', None)), fields=['-priority', 'timestamp'], name='dad_pending_intercom_idx'),
+        ),
+        AddIndex(
+            model_name='eventtodispatch',
+            index=models.Index(condition=models.Q(('send_user_dot_com', True), ('sent_user_dot_com', None)), fields=['-priority', 'timestamp'], name='dad_pending_user_dot_com_idx'),
+        ),
+        AddIndex(
+            model_name='eventtodispatch',
+            index=models.Index(condition=models.Q(('send_mix_panel', True), ('sent_mix_panel', None)), fields=['-priority', 'timestamp'], name='dad_pending_mix_panel_idx'),
+        ),
+        AddIndex(
+            model_name='eventtodispatch',
+            index=models.Index(condition=models.Q(('send_ga4', True), ('sent_ga4', None)), fields=['-priority', 'timestamp'], name='dad_pending_ga4_idx'),
+        ),
+    ]
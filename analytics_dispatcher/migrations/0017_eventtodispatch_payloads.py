@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_dispatcher', '0016_eventtodispatch_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventtodispatch',
+            name='payloads',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_dispatcher', '0017_eventtodispatch_payloads'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deliveryerror',
+            name='status',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'ok'), (2, 'error'), (3, 'user missing'), (4, 'rejected'), (5, 'expired')]),
+        ),
+        migrations.AlterField(
+            model_name='eventtodispatch',
+            name='status_amplitude',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'ok'), (2, 'error'), (3, 'user missing'), (4, 'rejected'), (5, 'expired')], null=True),
+        ),
+        migrations.AlterField(
+            model_name='eventtodispatch',
+            name='status_ga4',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'ok'), (2, 'error'), (3, 'user missing'), (4, 'rejected'), (5, 'expired')], null=True),
+        ),
+        migrations.AlterField(
+            model_name='eventtodispatch',
+            name='status_intercom',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'ok'), (2, 'error'), (3, 'user missing'), (4, 'rejected'), (5, 'expired')], null=True),
+        ),
+        migrations.AlterField(
+            model_name='eventtodispatch',
+            name='status_mix_panel',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'ok'), (2, 'error'), (3, 'user missing'), (4, 'rejected'), (5, 'expired')], null=True),
+        ),
+        migrations.AlterField(
+            model_name='eventtodispatch',
+            name='status_user_dot_com',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'ok'), (2, 'error'), (3, 'user missing'), (4, 'rejected'), (5, 'expired')], null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import connections, migrations, models
+
+from analytics_dispatcher import routers
+
+# CREATE INDEX CONCURRENTLY is PostgreSQL only
+AddIndex = AddIndexConcurrently if connections[routers.get_database()].vendor == 'postgresql' else migrations.AddIndex
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can not run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('analytics_dispatcher', '0018_expired_status'),
+    ]
+
+    operations = [
+        AddIndex(
+            model_name='eventtodispatch',
+            index=models.Index(fields=['timestamp'], name='dad_timestamp_idx'),
+        ),
+    ]
@@ -1,52 +1,173 @@
 
+import functools
 import hashlib
 import logging
+import operator
+import typing as t
 
 from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
+from . import payloads, routers, users
+from .users import UserSnapshot
+
 AMPLITUDE_SESSION_VALUES = ('device_id', 'session_id', 'ip',
                             'app_version', 'platform',
                             'os_name', 'os_version',
                             'device_brand', 'device_manufacturer', 'device_model',
                             )
 
+DESTINATIONS = ('amplitude', 'intercom', 'user_dot_com', 'mix_panel', 'ga4')
+
 logger = logging.getLogger(__name__)
 
 
+def pending_q(destination: str) -> models.Q:
+    return models.Q(**{'send_' + destination: True, 'sent_' + destination: None})
+
+
+class AnalyticsManager(models.Manager):
+    """
+    Queries go to DAD_DATABASE even without `routers.AnalyticsRouter` installed.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().using(routers.get_database())
+
+
+class DeliveryStatus(models.IntegerChoices):
+    """
+    Value of `status_<destination>`, details of failures are kept in `DeliveryError`.
+    """
+    OK = 1, 'ok'
+    ERROR = 2, 'error'
+    USER_MISSING = 3, 'user missing'
+    REJECTED = 4, 'rejected'
+    # older than the destination accepts, not sent, see `expiry`
+    EXPIRED = 5, 'expired'
+    # the destination has no configured backend, not sent, see `clients.registry.mark_disabled`
+    DISABLED = 6, 'disabled'
+
+
+# failures of a destination, events closed without a request (USER_MISSING, EXPIRED, DISABLED) are not errors
+ERROR_STATUSES = (DeliveryStatus.ERROR, DeliveryStatus.REJECTED)
+
+
+def errors_q(destination: str) -> models.Q:
+    return models.Q(**{'status_' + destination + '__in': ERROR_STATUSES})
+
+
+PENDING_Q = functools.reduce(operator.or_, (pending_q(d) for d in DESTINATIONS))
+ERRORS_Q = functools.reduce(operator.or_, (errors_q(d) for d in DESTINATIONS))
+
+
+class SessionInfo(models.Model):
+    """
+    Deduplicated `session_data` of events, used with DAD_NORMALIZE_SESSION_DATA, see `sessions`.
+    """
+    hash = models.CharField(max_length=56, unique=True)
+    data = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = AnalyticsManager()
+
+    def __str__(self):
+        return f'{self.pk}: {self.data}'
+
+
 class EventToDispatch(models.Model):
-    event_type = models.CharField(max_length=255)
+    event_type = models.CharField(max_length=255, db_index=True)
     timestamp = models.DateTimeField(auto_now_add=True)
-    user = models.ForeignKey(to=settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
+    # no constraint, the queue may be in another database (DAD_DATABASE), see `get_user`
+    user = models.ForeignKey(to=settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, null=True,
+                             db_constraint=False)
+    # user fields destinations need, captured by `emit` so dispatch does not read the user table
+    user_snapshot = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
     session_data = models.JSONField(default=dict)
+    # set instead of `session_data` with DAD_NORMALIZE_SESSION_DATA
+    session = models.ForeignKey(SessionInfo, on_delete=models.PROTECT, null=True, blank=True, related_name='events')
     user_properties = models.JSONField(default=dict)
     event_properties = models.JSONField(default=dict)
 
+    idempotency_key = models.CharField(max_length=80, null=True, blank=True)
+    rollup_key = models.CharField(max_length=56, null=True, blank=True)
+    # `EventType.priority` when emitted, higher lanes are dispatched first
+    priority = models.SmallIntegerField(default=0)
+    # destination payloads built at emit for event types with a schema, see `payloads.get_payload`
+    payloads = models.JSONField(null=True, blank=True)
+
     send_amplitude = models.BooleanField()
     sent_amplitude = models.DateTimeField(default=None, blank=True, null=True, db_index=True)
-    status_amplitude = models.CharField(max_length=256, null=True)
+    status_amplitude = models.PositiveSmallIntegerField(choices=DeliveryStatus.choices, null=True)
 
     send_intercom = models.BooleanField()
     sent_intercom = models.DateTimeField(default=None, blank=True, null=True, db_index=True)
-    status_intercom = models.CharField(max_length=256, null=True)
+    status_intercom = models.PositiveSmallIntegerField(choices=DeliveryStatus.choices, null=True)
 
     send_user_dot_com = models.BooleanField()
     sent_user_dot_com = models.DateTimeField(default=None, blank=True, null=True, db_index=True)
-    status_user_dot_com = models.CharField(max_length=256, null=True)
+    status_user_dot_com = models.PositiveSmallIntegerField(choices=DeliveryStatus.choices, null=True)
 
     send_mix_panel = models.BooleanField()
     sent_mix_panel = models.DateTimeField(default=None, blank=True, null=True, db_index=True)
-    status_mix_panel = models.CharField(max_length=256, null=True)
+    status_mix_panel = models.PositiveSmallIntegerField(choices=DeliveryStatus.choices, null=True)
 
     send_ga4 = models.BooleanField()
     sent_ga4 = models.DateTimeField(default=None, blank=True, null=True, db_index=True)
-    status_ga4 = models.CharField(max_length=256, null=True)
+    status_ga4 = models.PositiveSmallIntegerField(choices=DeliveryStatus.choices, null=True)
+
+    objects = AnalyticsManager()
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # pending events of each destination, used by dispatch claim queries and admin filters
+            models.Index(fields=['-priority', 'timestamp'], name='dad_pending_amplitude_idx',
+                         condition=models.Q(send_amplitude=True, sent_amplitude=None)),
+            models.Index(fields=['-priority', 'timestamp'], name='dad_pending_intercom_idx',
+                         condition=models.Q(send_intercom=True, sent_intercom=None)),
+            models.Index(fields=['-priority', 'timestamp'], name='dad_pending_user_dot_com_idx',
+                         condition=models.Q(send_user_dot_com=True, sent_user_dot_com=None)),
+            models.Index(fields=['-priority', 'timestamp'], name='dad_pending_mix_panel_idx',
+                         condition=models.Q(send_mix_panel=True, sent_mix_panel=None)),
+            models.Index(fields=['-priority', 'timestamp'], name='dad_pending_ga4_idx',
+                         condition=models.Q(send_ga4=True, sent_ga4=None)),
+            models.Index(fields=['timestamp'], name='dad_errors_idx', condition=ERRORS_Q),
+            # time range filters of export, requeue, reports and cleanup
+            models.Index(fields=['timestamp'], name='dad_timestamp_idx'),
+            models.Index(fields=['rollup_key', 'timestamp'], name='dad_rollup_idx',
+                         condition=models.Q(rollup_key__isnull=False)),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['idempotency_key'], name='dad_idempotency_key_uniq',
+                                    condition=models.Q(idempotency_key__isnull=False)),
+        ]
 
     def __str__(self):
-        return f'{self.event_type} @ {self.timestamp} by {self.user} id:{self.pk}'
+        return f'{self.event_type} @ {self.timestamp} by {self.get_user()} id:{self.pk}'
+
+    def get_user(self) -> t.Optional[UserSnapshot]:
+        """
+        User of the event as captured at emit time, it is available after the user is deleted.
+        Events queued before snapshots were introduced load the user.
+        """
+        if self.user_snapshot is not None:
+            return UserSnapshot(self.user_snapshot)
+        if self.user_id is not None:
+            try:
+                return users.from_user(self.user)
+            except ObjectDoesNotExist:
+                return None
+        return None
+
+    def get_session_data(self) -> dict:
+        if self.session_id is not None:
+            from . import sessions
+
+            return sessions.get_data(self.session_id)
+        return self.session_data
 
     @property
     def insert_id(self):
@@ -56,7 +177,7 @@ class EventToDispatch(models.Model):
         user_id, event_type, event_id, and time."
         """
         return hashlib.sha224('{}.{}.{}'.format(
-            self.id, self.event_type, self.session_data.get('device_id')).encode()).hexdigest()
+            self.id, self.event_type, self.get_session_data().get('device_id')).encode()).hexdigest()
 
     def dict_for_amplutude(self, users_cache):
         """
@@ -68,16 +189,16 @@ class EventToDispatch(models.Model):
 
         user_email = None
 
-        if self.user_id is not None:
-            if self.user_id not in users_cache:
-                # noinspection PyUnresolvedReferences
-                users_cache[self.user_id] = {
-                    'user_id': self.user.id,
-                    'email': self.user.email,
-                    'first_name': self.user.first_name,
-                    'last_name': self.user.last_name
+        user = self.get_user()
+        if user is not None:
+            if user.id not in users_cache:
+                users_cache[user.id] = {
+                    'user_id': user.id,
+                    'email': user.email,
+                    'first_name': user.first_name,
+                    'last_name': user.last_name
                 }
-            user_properties = users_cache[self.user_id]
+            user_properties = dict(users_cache[user.id])
             user_email = user_properties['email']
             event_properties['user_id'] = user_properties['user_id']
 
@@ -95,9 +216,10 @@ class EventToDispatch(models.Model):
             'user_properties': user_properties,
         }
 
+        session_data = self.get_session_data()
         for value_name in AMPLITUDE_SESSION_VALUES:
-            if value_name in self.session_data:
-                event_data[value_name] = self.session_data[value_name]
+            if value_name in session_data:
+                event_data[value_name] = session_data[value_name]
 
         return event_data
 
@@ -105,13 +227,7 @@ class EventToDispatch(models.Model):
         return self.event_properties
 
     def dict_for_intercom_user(self):
-        res = {}
-        for k, v in self.user_properties.items():
-            if type(v) == list:
-                res[k] = ', '.join(v)
-            else:
-                res[k] = v
-        return res
+        return payloads.intercom_user_properties(self.user_properties)
 
     def as_dict(self):
         """
@@ -119,13 +235,67 @@ class EventToDispatch(models.Model):
         """
 
         event_data = {
-            'user_id': getattr(self.user, 'email', None),
+            'user_id': getattr(self.get_user(), 'email', None),
             'event_id': self.id,
             'event_type': self.event_type,
             'insert_id': self.insert_id,
             'time': int(self.timestamp.timestamp()),
             'event_properties': self.event_properties,
             'user_properties': self.user_properties,
-            'session_data': self.session_data,
+            'session_data': self.get_session_data(),
         }
         return event_data
+
+
+class ShardLease(models.Model):
+    """
+    Ownership of a `user_id` shard of a destination queue by a dispatcher worker, see `sharding`.
+    """
+    destination = models.CharField(max_length=32)
+    shard = models.PositiveIntegerField()
+    owner = models.CharField(max_length=255, null=True, blank=True)
+    expires_at = models.DateTimeField()
+
+    objects = AnalyticsManager()
+
+    class Meta:
+        unique_together = [('destination', 'shard')]
+
+    def __str__(self):
+        return f'{self.destination}#{self.shard} by {self.owner} till {self.expires_at}'
+
+
+class EventLease(models.Model):
+    """
+    Claim of an event by a dispatcher worker for a destination, see `leasing`. Leases past `expires_at`
+    (of crashed or stuck workers) are ignored and replaced.
+    """
+    event = models.ForeignKey(EventToDispatch, on_delete=models.CASCADE, related_name='leases')
+    destination = models.CharField(max_length=32)
+    worker_id = models.CharField(max_length=255, db_index=True)
+    expires_at = models.DateTimeField()
+
+    objects = AnalyticsManager()
+
+    class Meta:
+        unique_together = [('event', 'destination')]
+
+    def __str__(self):
+        return f'{self.destination} event {self.event_id} by {self.worker_id} till {self.expires_at}'
+
+
+class DeliveryError(models.Model):
+    """
+    Append-only log of failed deliveries. Rows outlive cleaned up events, so there is no FK constraint.
+    """
+    event = models.ForeignKey(EventToDispatch, on_delete=models.DO_NOTHING, db_constraint=False,
+                              related_name='delivery_errors')
+    destination = models.CharField(max_length=32)
+    status = models.PositiveSmallIntegerField(choices=DeliveryStatus.choices)
+    message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = AnalyticsManager()
+
+    def __str__(self):
+        return f'{self.destination} {self.get_status_display()} for event {self.event_id}'
@@ -0,0 +1,64 @@
+import typing as t
+
+# GA4 limit of user property names
+GA4_USER_PROPERTY_NAME_LENGTH = 24
+# user properties sent as standard Intercom user attributes, others are custom attributes
+INTERCOM_USER_ATTRIBUTES = {'user_id', 'email', 'phone', 'pseudonym', 'name',
+                            'referrer', 'utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content'}
+
+
+def ga4(event_properties: t.Mapping, user_properties: t.Mapping) -> dict:
+    return {
+        'params': {key: str(value) for key, value in event_properties.items()},
+        'user_properties': {key[:GA4_USER_PROPERTY_NAME_LENGTH]: {'value': str(value)}
+                            for key, value in user_properties.items()},
+    }
+
+
+def intercom_user_properties(user_properties: t.Mapping) -> dict:
+    return {key: ', '.join(value) if isinstance(value, list) else value for key, value in user_properties.items()}
+
+
+def intercom(event_properties: t.Mapping, user_properties: t.Mapping) -> dict:
+    """
+    `user_attributes` are standard Intercom user attributes with the rest of user properties in `custom_attributes`.
+    """
+    user_attributes, custom_attributes = {}, {}
+    for key, value in intercom_user_properties(user_properties).items():
+        if key in INTERCOM_USER_ATTRIBUTES:
+            user_attributes[key] = value
+        else:
+            custom_attributes[key] = value
+    if custom_attributes:
+        user_attributes['custom_attributes'] = custom_attributes
+    return {
+        'event_properties': dict(event_properties),
+        'user_attributes': user_attributes,
+    }
+
+
+def mix_panel(event_properties: t.Mapping, user_properties: t.Mapping) -> dict:
+    user_properties = dict(user_properties)
+    return {
+        'user_id': user_properties.pop('user_id', None),
+        'event_properties': dict(event_properties),
+        'user_properties': user_properties,
+    }
+
+
+# destination -> function building its payload from event and user properties
+TRANSFORMS: t.Dict[str, t.Callable[[t.Mapping, t.Mapping], dict]] = {
+    'ga4': ga4,
+    'intercom': intercom,
+    'mix_panel': mix_panel,
+}
+
+
+def get_payload(event, destination: str) -> dict:
+    """
+    Payload of `event` for `destination`, prepared at emit time or built now for events stored without one.
+    """
+    payload = (event.payloads or {}).get(destination)
+    if payload is None:
+        payload = TRANSFORMS[destination](event.event_properties, event.user_properties)
+    return payload
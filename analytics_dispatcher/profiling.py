@@ -0,0 +1,126 @@
+import contextvars
+import cProfile
+import functools
+import itertools
+import logging
+import os
+import pstats
+import time
+import typing as t
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('analytics_dispatcher_profile', default=None)
+_counters = {}
+
+
+class Profile:
+    def __init__(self, name: str, profiler: t.Optional[cProfile.Profile] = None,
+                 parent: t.Optional['Profile'] = None):
+        self.name = name
+        self.timings = {}
+        self.profiler = profiler
+        # cProfile can not run nested, profiles inside a sampled one are not sampled
+        self.sampled = profiler is not None or (parent is not None and parent.sampled)
+
+    def add(self, stage_name: str, duration: float):
+        self.timings[stage_name] = self.timings.get(stage_name, 0.0) + duration
+
+
+def _get_callback():
+    callback = getattr(settings, 'DAD_PROFILE_CALLBACK', None)
+    if isinstance(callback, str):
+        module, name = callback.rsplit('.', 1)
+        try:
+            module = __import__(module, fromlist=[name])
+        except ModuleNotFoundError:
+            logger.exception("can't init profile callback")
+            return None
+        callback = getattr(module, name, None)
+    return callback
+
+
+def _should_sample(name: str) -> bool:
+    rate = getattr(settings, 'DAD_PROFILE_SAMPLE_RATE', 0)
+    if not rate:
+        return False
+    counter = _counters.setdefault(name, itertools.count())
+    return next(counter) % rate == 0
+
+
+def _dump_stats(name: str, profiler: cProfile.Profile) -> pstats.Stats:
+    stats = pstats.Stats(profiler)
+    dump_dir = getattr(settings, 'DAD_PROFILE_DIR', None)
+    if dump_dir:
+        path = os.path.join(dump_dir, f'{name}-{os.getpid()}-{int(time.time() * 1000)}.prof')
+        try:
+            stats.dump_stats(path)
+        except OSError:
+            logger.exception('can not dump profile stats to %s', path)
+    return stats
+
+
+@contextmanager
+def profile(name: str):
+    """
+    Profile a hot path.
+
+    Disabled unless DAD_PROFILE_CALLBACK is set. When enabled, durations of `stage` blocks executed inside are
+    summed up and passed to the callback as `callback(name, timings, stats)`. Every DAD_PROFILE_SAMPLE_RATE-th call
+    is additionally run under cProfile, `stats` is None for the rest. A profile opened inside another one
+    (dispatch run by `emit` with `sync_run`) is reported separately, stages count in the innermost profile.
+    """
+    callback = _get_callback()
+    if callback is None:
+        yield None
+        return
+
+    parent = _current.get()
+    sample = _should_sample(name) and not (parent is not None and parent.sampled)
+    profiler = cProfile.Profile() if sample else None
+    current = Profile(name, profiler, parent)
+    token = _current.set(current)
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield current
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        current.add('total', time.perf_counter() - start)
+        _current.reset(token)
+        stats = _dump_stats(name, profiler) if profiler is not None else None
+        try:
+            callback(name, current.timings, stats)
+        except Exception:
+            logger.exception('profile callback failed')
+
+
+def profiled(name: str):
+    """
+    Decorator running the function inside `profile(name)`.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profile(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def stage(name: str):
+    current = _current.get()
+    if current is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.add(name, time.perf_counter() - start)
@@ -0,0 +1,128 @@
+import datetime
+import typing as t
+
+from django.db import connections
+from django.db.models import Aggregate, Count, DurationField, ExpressionWrapper, F, Q
+
+from .models import DeliveryStatus, EventToDispatch, pending_q
+
+PERCENTILES = (0.5, 0.95, 0.99)
+# upper bounds of latency histogram buckets in seconds, where percentile functions are not available
+BUCKETS = (1, 5, 15, 60, 300, 900, 3600, 4 * 3600, 24 * 3600)
+DEFAULT_POINTS = 24
+
+
+class PercentileCont(Aggregate):
+    """
+    PostgreSQL `percentile_cont(fraction) WITHIN GROUP (ORDER BY expression)`.
+    """
+    function = 'PERCENTILE_CONT'
+    template = '%(function)s(%(fraction)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+
+    def __init__(self, expression, fraction: float, **extra):
+        super().__init__(expression, fraction=float(fraction), **extra)
+
+
+def has_percentiles(queryset) -> bool:
+    return connections[queryset.db].vendor == 'postgresql'
+
+
+def percentile_key(fraction: float) -> str:
+    return f'p{fraction * 100:g}'
+
+
+def delivered(destination: str, since: datetime.datetime, until: datetime.datetime,
+              event_types: t.Optional[t.List[str]] = None):
+    """
+    Events delivered to `destination` within [since, until), a range of the indexed `sent_` column.
+    """
+    queryset = EventToDispatch.objects.filter(**{'sent_' + destination + '__gte': since,
+                                                 'sent_' + destination + '__lt': until,
+                                                 'status_' + destination: DeliveryStatus.OK})
+    if event_types:
+        queryset = queryset.filter(event_type__in=event_types)
+    return queryset
+
+
+def _seconds(value) -> t.Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+def _from_histogram(row: dict) -> dict:
+    """
+    Percentile upper bounds of a bucketed row, None for latencies beyond the last bucket.
+    """
+    histogram = [(bound, row.pop(f'le_{bound}')) for bound in BUCKETS]
+    count = row['count']
+    for fraction in PERCENTILES:
+        row[percentile_key(fraction)] = next(
+            (bound for bound, cumulative in histogram if cumulative >= fraction * count), None)
+    row['histogram'] = histogram
+    return row
+
+
+def latency(destination: str, since: datetime.datetime, until: datetime.datetime,
+            event_types: t.Optional[t.List[str]] = None) -> t.List[dict]:
+    """
+    Emit-to-delivery latency of `destination` per event type: count and percentiles in seconds.
+    Computed by the database, with PostgreSQL exactly, elsewhere as upper bounds of histogram buckets.
+    """
+    queryset = delivered(destination, since, until, event_types)
+    sent = F('sent_' + destination)
+    if has_percentiles(queryset):
+        delay = ExpressionWrapper(sent - F('timestamp'), output_field=DurationField())
+        aggregates = {percentile_key(fraction): PercentileCont(delay, fraction, output_field=DurationField())
+                      for fraction in PERCENTILES}
+    else:
+        # cumulative bucket counts, comparing datetimes works on every backend
+        aggregates = {f'le_{bound}': Count('pk', filter=Q(**{
+            'sent_' + destination + '__lte': F('timestamp') + datetime.timedelta(seconds=bound)}))
+            for bound in BUCKETS}
+    rows = queryset.values('event_type').annotate(count=Count('pk'), **aggregates).order_by('event_type')
+    report = []
+    for row in rows:
+        if has_percentiles(queryset):
+            for fraction in PERCENTILES:
+                row[percentile_key(fraction)] = _seconds(row[percentile_key(fraction)])
+        else:
+            row = _from_histogram(row)
+        row['destination'] = destination
+        report.append(row)
+    return report
+
+
+def backlog(destination: str, since: datetime.datetime, until: datetime.datetime, points: int = DEFAULT_POINTS,
+            event_types: t.Optional[t.List[str]] = None) -> t.List[t.Tuple[datetime.datetime, int]]:
+    """
+    Number of events pending for `destination` at `points` moments of [since, until], one aggregate query.
+    Events removed by `cleanup_old_events` are not counted.
+    """
+    sent = 'sent_' + destination
+    step = (until - since) / max(points - 1, 1)
+    moments = [since + step * i for i in range(points)]
+    # events still pending or delivered after `since`, both sides are indexed
+    queryset = EventToDispatch.objects.filter(pending_q(destination) | Q(**{sent + '__gte': since}),
+                                              timestamp__lte=until)
+    if event_types:
+        queryset = queryset.filter(event_type__in=event_types)
+    counts = queryset.aggregate(**{
+        f'at_{i}': Count('pk', filter=Q(timestamp__lte=moment) & (Q(**{sent + '__isnull': True})
+                                                                   | Q(**{sent + '__gt': moment})))
+        for i, moment in enumerate(moments)})
+    return [(moment, counts[f'at_{i}']) for i, moment in enumerate(moments)]
+
+
+def report(destinations: t.List[str], since: datetime.datetime, until: datetime.datetime,
+           points: int = DEFAULT_POINTS, event_types: t.Optional[t.List[str]] = None) -> dict:
+    return {
+        'since': since,
+        'until': until,
+        'latency': [row for destination in destinations
+                    for row in latency(destination, since, until, event_types)],
+        'backlog': {destination: backlog(destination, since, until, points, event_types)
+                    for destination in destinations},
+    }
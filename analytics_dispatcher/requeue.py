@@ -0,0 +1,66 @@
+import logging
+import time
+import typing as t
+
+from django.db.models import Max, Min
+
+from .models import DeliveryStatus, EventToDispatch, pending_q
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 5000
+# failures worth sending again, USER_MISSING, EXPIRED and DISABLED events would be skipped, expire or close again
+RETRIABLE_STATUSES = (DeliveryStatus.ERROR, DeliveryStatus.REJECTED)
+
+
+def pk_bounds(queryset) -> t.Tuple[t.Optional[int], t.Optional[int]]:
+    bounds = queryset.aggregate(first=Min('pk'), last=Max('pk'))
+    return bounds['first'], bounds['last']
+
+
+def requeue_chunks(queryset, destination: str, start_pk: int, end_pk: int,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE, sleep: float = 0.0,
+                   max_pending: t.Optional[int] = None) -> t.Iterator[t.Tuple[int, int, int]]:
+    """
+    Mark events of `queryset` with pk in [start_pk, end_pk] to be sent to `destination` again, one UPDATE
+    per `chunk_size` pks. Yield (first pk, last pk, updated count) after each chunk.
+
+    Waits `sleep` seconds between chunks and, with `max_pending`, while the destination has that many
+    pending events, so the dispatcher is not flooded.
+    """
+    values = {'send_' + destination: True, 'sent_' + destination: None, 'status_' + destination: None}
+    pending = EventToDispatch.objects.filter(pending_q(destination))
+    low = start_pk
+    while low <= end_pk:
+        high = min(low + chunk_size - 1, end_pk)
+        count = queryset.filter(pk__gte=low, pk__lte=high).update(**values)
+        yield low, high, count
+        low = high + 1
+        if low > end_pk:
+            break
+        if sleep:
+            time.sleep(sleep)
+        while max_pending is not None and pending[:max_pending].count() >= max_pending:
+            logger.info('%s has %d pending events, waiting', destination, max_pending)
+            time.sleep(max(sleep, 1.0))
+
+
+def filter_events(destination: str, since=None, until=None, event_types: t.Optional[t.List[str]] = None,
+                  errors_only: bool = False, new_destination: bool = False):
+    """
+    Events to requeue, only those of event types sent to `destination` unless `new_destination` backfills
+    a destination to all events.
+    """
+    if new_destination:
+        queryset = EventToDispatch.objects.all()
+    else:
+        queryset = EventToDispatch.objects.filter(**{'send_' + destination: True})
+    if since is not None:
+        queryset = queryset.filter(timestamp__gte=since)
+    if until is not None:
+        queryset = queryset.filter(timestamp__lt=until)
+    if event_types:
+        queryset = queryset.filter(event_type__in=event_types)
+    if errors_only:
+        queryset = queryset.filter(**{'status_' + destination + '__in': RETRIABLE_STATUSES})
+    return queryset
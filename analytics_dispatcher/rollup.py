@@ -0,0 +1,54 @@
+import hashlib
+import json
+import logging
+import typing as t
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils.timezone import now
+
+from . import routers
+from .models import DESTINATIONS, EventLease, EventToDispatch
+
+logger = logging.getLogger(__name__)
+
+COUNT_PROPERTY = 'rollup_count'
+FIRST_TIMESTAMP_PROPERTY = 'rollup_first_timestamp'
+LAST_TIMESTAMP_PROPERTY = 'rollup_last_timestamp'
+
+
+def make_key(event_name: str, subject: t.Optional[str], event_properties: dict) -> str:
+    properties = json.dumps(event_properties, sort_keys=True, default=str)
+    return hashlib.sha224(f'{event_name}:{subject}:{properties}'.encode()).hexdigest()
+
+
+def init_properties(event_properties: dict) -> dict:
+    timestamp = now().isoformat()
+    event_properties = dict(event_properties)
+    event_properties[COUNT_PROPERTY] = 1
+    event_properties[FIRST_TIMESTAMP_PROPERTY] = timestamp
+    event_properties[LAST_TIMESTAMP_PROPERTY] = timestamp
+    return event_properties
+
+
+def collapse(rollup_key: str, window: int) -> t.Optional[EventToDispatch]:
+    """
+    Count the event into a not yet dispatched event with the same key emitted within the window.
+    Events being sent by a dispatcher are leased (or locked while claimed) and skipped, a new event is stored then.
+    """
+    current_time = now()
+    unsent = {'sent_' + destination: None for destination in DESTINATIONS}
+    leased = EventLease.objects.filter(event=OuterRef('pk'), expires_at__gt=current_time)
+    with transaction.atomic(using=routers.get_database()):
+        event = (EventToDispatch.objects.select_for_update(skip_locked=True)
+                 .filter(~Exists(leased), rollup_key=rollup_key,
+                         timestamp__gte=current_time - timedelta(seconds=window), **unsent)
+                 .order_by('-timestamp').first())
+        if event is None:
+            return None
+        event.event_properties[COUNT_PROPERTY] = event.event_properties.get(COUNT_PROPERTY, 1) + 1
+        event.event_properties[LAST_TIMESTAMP_PROPERTY] = current_time.isoformat()
+        event.save(update_fields=['event_properties'])
+    logger.debug('event %s collapsed into %s', rollup_key, event.pk)
+    return event
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+APP_LABEL = 'analytics_dispatcher'
+
+
+def get_database() -> str:
+    """
+    Database alias of the event queue, DAD_DATABASE (default is 'default').
+    """
+    return getattr(settings, 'DAD_DATABASE', DEFAULT_DB_ALIAS)
+
+
+def _is_ours(model) -> bool:
+    return model._meta.app_label == APP_LABEL
+
+
+class AnalyticsRouter:
+    """
+    Keeps analytics_dispatcher tables on DAD_DATABASE:
+
+        DATABASE_ROUTERS = ['analytics_dispatcher.routers.AnalyticsRouter']
+    """
+
+    def _route(self, model, hints):
+        if _is_ours(model):
+            return get_database()
+        instance = hints.get('instance')
+        if instance is not None and _is_ours(type(instance)):
+            # related objects of events (users) live in the default database
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if _is_ours(type(obj1)) or _is_ours(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == APP_LABEL:
+            return db == get_database()
+        return None
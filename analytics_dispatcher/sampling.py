@@ -0,0 +1,58 @@
+import logging
+import random
+import time
+import typing as t
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .data_structures import EventType
+
+logger = logging.getLogger(__name__)
+
+
+def get_subject(event_type: EventType, user_id, device_id) -> t.Optional[str]:
+    if event_type.limit_by == 'device' or user_id is None:
+        return None if device_id is None else f'd:{device_id}'
+    return f'u:{user_id}'
+
+
+def in_sample(event_type: EventType, subject: t.Optional[str]) -> bool:
+    """
+    Deterministic by subject, so all events of a sampled user (or device) are kept and funnels stay consistent.
+    """
+    if subject is None:
+        return random.random() < event_type.sample_rate
+    return zlib.crc32(f'{event_type.name}:{subject}'.encode()) / 0x100000000 < event_type.sample_rate
+
+
+def is_throttled(event_type: EventType, subject: t.Optional[str]) -> bool:
+    if event_type.rate_limit is None or subject is None:
+        return False
+    limit, period = event_type.rate_limit
+    key = f'analytics_dispatcher:rate:{event_type.name}:{subject}:{int(time.time() // period)}'
+    cache.add(key, 0, period)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # expired between add and incr
+        return False
+    return count > limit
+
+
+def sample_weight_property() -> str:
+    return getattr(settings, 'DAD_SAMPLE_WEIGHT_PROPERTY', 'sample_weight')
+
+
+def accept(event_type: EventType, user_id, device_id) -> bool:
+    """
+    Sampling and rate limits of an event type, checked before the event is stored.
+    """
+    subject = get_subject(event_type, user_id, device_id)
+    if event_type.sample_rate < 1.0 and not in_sample(event_type, subject):
+        return False
+    if is_throttled(event_type, subject):
+        logger.debug('event "%s" of %s throttled', event_type.name, subject)
+        return False
+    return True
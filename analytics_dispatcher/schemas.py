@@ -0,0 +1,96 @@
+import typing as t
+
+from . import payloads
+from .data_structures import EventType
+
+PROPERTY_KINDS = ('event_properties', 'user_properties')
+_MISSING = object()
+
+
+class optional:
+    """
+    Schema of a property which may be absent or None: `optional(str)`, `optional(int, float)`.
+    """
+    __slots__ = ('types',)
+
+    def __init__(self, *types: type):
+        self.types = types
+
+
+class InvalidEvent(ValueError):
+    """
+    Properties of an event don't match the schema of its type, raised by `emit(raise_invalid=True)`.
+    """
+
+    def __init__(self, event_name: str, errors: t.List[str]):
+        super().__init__(f'invalid event "{event_name}": {"; ".join(errors)}')
+        self.errors = errors
+
+
+def _type_names(types: tuple) -> str:
+    return ' or '.join(type_.__name__ for type_ in types)
+
+
+def compile_properties(kind: str, schema: t.Mapping[str, t.Any]) -> t.Callable[[t.Mapping], t.List[str]]:
+    """
+    Validator of a properties dict for a schema {name: type, tuple of types or `optional(...)`}.
+    Properties missing in the schema are allowed. Returns the list of errors.
+    """
+    required, not_required = [], []
+    for name, spec in schema.items():
+        if isinstance(spec, optional):
+            not_required.append((name, spec.types, bool not in spec.types))
+        else:
+            types = spec if isinstance(spec, tuple) else (spec,)
+            required.append((name, types, bool not in types))
+    required, not_required = tuple(required), tuple(not_required)
+
+    def validate(properties: t.Mapping) -> t.List[str]:
+        errors = []
+        for name, types, no_bool in required:
+            value = properties.get(name, _MISSING)
+            if value is _MISSING or value is None:
+                errors.append(f'{kind}.{name} is required')
+            elif not isinstance(value, types) or (no_bool and isinstance(value, bool)):
+                errors.append(f'{kind}.{name} must be {_type_names(types)}')
+        for name, types, no_bool in not_required:
+            value = properties.get(name)
+            if value is not None and (not isinstance(value, types) or (no_bool and isinstance(value, bool))):
+                errors.append(f'{kind}.{name} must be {_type_names(types)}')
+        return errors
+
+    return validate
+
+
+class CompiledSchema:
+    """
+    Validators and destination transforms of an event type, built once when the dispatcher starts.
+    """
+
+    def __init__(self, event_type: EventType):
+        self.validators = tuple((kind, compile_properties(kind, event_type.schema[kind]))
+                                for kind in PROPERTY_KINDS if event_type.schema.get(kind))
+        # rolled up events change their properties after being stored, their payloads are built at dispatch
+        self.transforms = {} if event_type.rollup_window else dict(payloads.TRANSFORMS)
+
+    def validate(self, event_properties: t.Mapping, user_properties: t.Mapping) -> t.List[str]:
+        properties = {'event_properties': event_properties, 'user_properties': user_properties}
+        errors = [f'{kind} must be an object' for kind in PROPERTY_KINDS
+                  if not isinstance(properties[kind], t.Mapping)]
+        if errors:
+            return errors
+        return [error for kind, validator in self.validators for error in validator(properties[kind])]
+
+    def build_payloads(self, event_properties: t.Mapping, user_properties: t.Mapping,
+                       destinations: t.Iterable[str]) -> t.Optional[dict]:
+        """
+        Payloads of the `destinations` the event is sent to, None if none of them has a transform.
+        """
+        built = {destination: self.transforms[destination](event_properties, user_properties)
+                 for destination in destinations if destination in self.transforms}
+        return built or None
+
+
+def compile_event_types(event_types: t.Iterable[EventType]) -> t.Dict[str, CompiledSchema]:
+    return {event_type.name: CompiledSchema(event_type) for event_type in event_types
+            if event_type.schema is not None}
@@ -0,0 +1,63 @@
+import json
+import logging
+import random
+
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+JSON_CONTENT_TYPE = 'application/json'
+
+
+def _use_orjson() -> bool:
+    backend = getattr(settings, 'DAD_JSON_BACKEND', None)
+    if backend == 'json':
+        return False
+    if backend == 'orjson' and orjson is None:
+        logger.warning('DAD_JSON_BACKEND is "orjson" but orjson is not installed, fall back to json')
+    return orjson is not None
+
+
+def dumps(obj) -> bytes:
+    """
+    Serialize outbound request body, orjson is used when installed unless DAD_JSON_BACKEND = 'json'.
+    """
+    if _use_orjson():
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+class LazyJson:
+    """
+    Log argument which is serialized only if the record is really emitted.
+    """
+    __slots__ = ('obj',)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        try:
+            return dumps(self.obj).decode()
+        except (TypeError, ValueError):
+            return repr(self.obj)
+
+
+def payload_logging_enabled(payload_logger: logging.Logger, level: int = logging.INFO) -> bool:
+    if not payload_logger.isEnabledFor(level):
+        return False
+    rate = getattr(settings, 'DAD_PAYLOAD_LOG_SAMPLE_RATE', 1.0)
+    return rate >= 1.0 or random.random() < rate
+
+
+def log_payload(payload_logger: logging.Logger, level: int, msg: str, *args):
+    """
+    Level-guarded and sampled (DAD_PAYLOAD_LOG_SAMPLE_RATE) logging of request and response payloads.
+    """
+    if payload_logging_enabled(payload_logger, level):
+        payload_logger.log(level, msg, *args)
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import threading
+import time
+import typing as t
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import SessionInfo
+
+DEFAULT_CACHE_SIZE = 10000
+# shorter than the life of sent events, so a cached id always has events and is not cleaned up
+DEFAULT_CACHE_TTL = 3600
+
+
+def is_enabled() -> bool:
+    return getattr(settings, 'DAD_NORMALIZE_SESSION_DATA', False)
+
+
+def make_hash(data: t.Mapping) -> str:
+    return hashlib.sha224(json.dumps(dict(data), sort_keys=True, separators=(',', ':'),
+                                     default=str).encode()).hexdigest()
+
+
+class LruCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def add(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_cache_size = getattr(settings, 'DAD_SESSION_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+# hash -> (expiration, SessionInfo id), id -> data
+ids_cache = LruCache(_cache_size)
+data_cache = LruCache(_cache_size)
+
+
+def intern(data: t.Mapping) -> int:
+    """
+    Id of the `SessionInfo` row with `data`, created if needed.
+    """
+    key = make_hash(data)
+    cached = ids_cache.get(key)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    session_id = SessionInfo.objects.get_or_create(hash=key, defaults={'data': dict(data)})[0].pk
+    ttl = getattr(settings, 'DAD_SESSION_CACHE_TTL', DEFAULT_CACHE_TTL)
+    ids_cache.add(key, (time.monotonic() + ttl, session_id))
+    data_cache.add(session_id, dict(data))
+    return session_id
+
+
+def get_data(session_id: int) -> dict:
+    data = data_cache.get(session_id)
+    if data is None:
+        data = SessionInfo.objects.filter(pk=session_id).values_list('data', flat=True).first() or {}
+        data_cache.add(session_id, data)
+    return data
+
+
+def prefetch(events: t.Iterable) -> None:
+    """
+    Load session data of `events` missing in the cache with one query.
+    """
+    missing = {event.session_id for event in events
+               if event.session_id is not None and data_cache.get(event.session_id) is None}
+    if missing:
+        for session_id, data in SessionInfo.objects.filter(pk__in=missing).values_list('pk', 'data'):
+            data_cache.add(session_id, data)
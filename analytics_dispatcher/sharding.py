@@ -0,0 +1,68 @@
+import logging
+import os
+import socket
+import typing as t
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q, Value
+from django.db.models.functions import Coalesce, Mod
+from django.utils.timezone import now
+
+from . import routers
+from .models import ShardLease
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEASE_TTL = 300
+
+
+def get_shard_count() -> int:
+    """
+    DAD_SHARD_COUNT, number of user shards the queue is processed in by parallel workers, 0 if not sharded.
+    """
+    return getattr(settings, 'DAD_SHARD_COUNT', 0)
+
+
+def default_worker_id() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def filter_shard(queryset, shard: t.Tuple[int, int]):
+    """
+    Limit queryset of events to a shard, `shard` is a pair (index, count). Events without user go to shard 0.
+    """
+    index, count = shard
+    return (queryset
+            .alias(dad_shard=Mod(Coalesce('user_id', Value(0)), Value(count)))
+            .filter(dad_shard=index))
+
+
+def acquire(destination: str, shard: int, worker_id: str, ttl: int = DEFAULT_LEASE_TTL) -> bool:
+    """
+    Take or prolong the lease of a shard. Only one worker at a time processes a shard of a destination,
+    so events of the same user are delivered in order.
+    """
+    current_time = now()
+    if not ShardLease.objects.filter(destination=destination, shard=shard).exists():
+        try:
+            with transaction.atomic(using=routers.get_database()):
+                ShardLease.objects.create(destination=destination, shard=shard, expires_at=current_time)
+        except IntegrityError:
+            pass
+    return (ShardLease.objects
+            .filter(destination=destination, shard=shard)
+            .filter(Q(owner=worker_id) | Q(owner=None) | Q(expires_at__lt=current_time))
+            .update(owner=worker_id, expires_at=current_time + timedelta(seconds=ttl))) == 1
+
+
+def release(destination: str, shard: int, worker_id: str):
+    ShardLease.objects.filter(destination=destination, shard=shard, owner=worker_id).update(owner=None)
+
+
+def shard_order(shard_count: int, worker_id: str) -> t.List[int]:
+    # workers start from different shards, so they do not compete for the same leases
+    offset = zlib.crc32(worker_id.encode()) % shard_count
+    return [(offset + i) % shard_count for i in range(shard_count)]
@@ -1 +1,818 @@
-# Create your tests here.
+import argparse
+import datetime
+import gzip
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import typing as t
+from unittest import mock
+
+from django.contrib.admin.sites import site
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils.timezone import now
+
+from . import (admin, batching, circuit, context as analytics_context, event, expiry, export, fanout, idempotency,
+               instant, leasing, payloads, profiling, reporting, requeue, rollup, routers, sampling, schemas,
+               serialization, sessions, sharding, users)
+from .clients import _base, _transport, registry, user_dot_com
+from .data_structures import EventType
+from .management.utils import parse_time
+from .models import (DESTINATIONS, ERRORS_Q, DeliveryStatus, EventLease, EventToDispatch, SessionInfo, ShardLease,
+                     errors_q, pending_q)
+
+
+def create_event(**fields) -> EventToDispatch:
+    values = {'event_type': 'TEST'}
+    values.update({'send_' + destination: False for destination in DESTINATIONS})
+    values.update(fields)
+    return EventToDispatch.objects.create(**values)
+
+
+class FakeBackend(_base.AnalyticsBackend):
+    """
+    Delivers events with `status`, raises DestinationUnavailable with `status=None`.
+    """
+    def __init__(self, service_name: str = 'amplitude', status: t.Optional[int] = DeliveryStatus.OK):
+        self.SERVICE_NAME = service_name
+        self.status = status
+        self.delivered = []
+
+    def status_fields(self):
+        # per instance SERVICE_NAME
+        return 'sent_' + self.SERVICE_NAME, 'status_' + self.SERVICE_NAME
+
+    def deliver(self, event):
+        if self.status is None:
+            raise _base.DestinationUnavailable('503')
+        self.delivered.append(event.pk)
+        _base.set_status(event, self.SERVICE_NAME, self.status)
+
+
+@override_settings(DAD_PROFILE_CALLBACK=None, DAD_PROFILE_SAMPLE_RATE=0)
+class ProfilingTest(SimpleTestCase):
+    def setUp(self):
+        self.reports = []
+
+    def callback(self, name, timings, stats):
+        self.reports.append((name, sorted(timings), stats is not None))
+
+    def test_disabled_without_callback(self):
+        with profiling.profile('emit') as current:
+            with profiling.stage('insert'):
+                pass
+        self.assertIsNone(current)
+
+    def test_nested_profiles_report_separately(self):
+        with override_settings(DAD_PROFILE_CALLBACK=self.callback):
+            with profiling.profile('emit'):
+                with profiling.stage('insert'):
+                    pass
+                with profiling.stage('schedule'):
+                    with profiling.profile('dispatch.amplitude'):
+                        with profiling.stage('http'):
+                            pass
+        self.assertEqual(self.reports, [('dispatch.amplitude', ['http', 'total'], False),
+                                        ('emit', ['insert', 'schedule', 'total'], False)])
+
+    def test_sampled_profile(self):
+        profiled_emit = profiling.profiled('emit')(lambda: None)
+        with override_settings(DAD_PROFILE_CALLBACK=self.callback, DAD_PROFILE_SAMPLE_RATE=1):
+            profiled_emit()
+            with profiling.profile('outer'):
+                with profiling.profile('inner'):
+                    pass
+        self.assertEqual(self.reports, [('emit', ['total'], True), ('inner', ['total'], False),
+                                        ('outer', ['total'], True)])
+
+
+class TransportTest(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(_transport._sessions, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(DAD_HTTP_TIMEOUT={'default': [1, 2], 'ga4': 5})
+    def test_timeout_by_destination(self):
+        self.assertEqual(_transport.get_timeout('amplitude'), (1, 2))
+        self.assertEqual(_transport.get_timeout('ga4'), 5)
+
+    @override_settings(DAD_HTTP_POOL_SIZE={'default': 4}, DAD_HTTP_RETRIES=2)
+    def test_session_is_shared_within_process(self):
+        session = _transport.get_session('amplitude')
+        self.assertIs(_transport.get_session('amplitude'), session)
+        self.assertIsNot(_transport.get_session('ga4'), session)
+
+        adapter = session.get_adapter('https://api2.amplitude.com')
+        self.assertEqual(adapter._pool_maxsize, 4)
+        # requests which reached the server are not repeated
+        self.assertEqual((adapter.max_retries.connect, adapter.max_retries.read), (2, 0))
+
+        with mock.patch('os.getpid', return_value=-1):
+            self.assertIsNot(_transport.get_session('amplitude'), session)
+
+
+class SerializationTest(SimpleTestCase):
+    @override_settings(DAD_JSON_BACKEND='json')
+    def test_json_backend(self):
+        self.assertEqual(serialization.dumps({'a': [1, 'b']}), b'{"a":[1,"b"]}')
+
+    def test_default_backend(self):
+        body = serialization.dumps({'a': 1, 'b': None})
+        self.assertIsInstance(body, bytes)
+        self.assertEqual(json.loads(body), {'a': 1, 'b': None})
+
+    def test_lazy_json_is_serialized_when_logged(self):
+        with mock.patch.object(serialization, 'dumps', wraps=serialization.dumps) as dumps:
+            payload = serialization.LazyJson({'a': 1})
+            dumps.assert_not_called()
+            self.assertEqual(json.loads(str(payload)), {'a': 1})
+        self.assertEqual(str(serialization.LazyJson({1, 2})), repr({1, 2}))
+
+    def test_log_payload_sampling(self):
+        payload_logger = logging.getLogger('analytics_dispatcher.tests.payload')
+        payload_logger.setLevel(logging.INFO)
+        with mock.patch.object(payload_logger, 'log') as log:
+            with override_settings(DAD_PAYLOAD_LOG_SAMPLE_RATE=0.0):
+                serialization.log_payload(payload_logger, logging.INFO, 'body %s', 1)
+            log.assert_not_called()
+            serialization.log_payload(payload_logger, logging.DEBUG, 'body %s', 1)
+            log.assert_not_called()
+            with override_settings(DAD_PAYLOAD_LOG_SAMPLE_RATE=1.0):
+                serialization.log_payload(payload_logger, logging.INFO, 'body %s', 1)
+            log.assert_called_once_with(logging.INFO, 'body %s', 1)
+
+
+class ShardingTest(TestCase):
+    databases = '__all__'
+
+    def test_filter_shard(self):
+        events = [create_event(user_id=user_id) for user_id in (None, 1, 2, 3, 4)]
+        shards = [set(sharding.filter_shard(EventToDispatch.objects.all(), (index, 2))) for index in range(2)]
+        self.assertEqual(shards, [{events[0], events[2], events[4]}, {events[1], events[3]}])
+
+    def test_lease_is_exclusive_until_expired(self):
+        self.assertTrue(sharding.acquire('amplitude', 0, 'w1'))
+        self.assertTrue(sharding.acquire('amplitude', 0, 'w1'))
+        self.assertFalse(sharding.acquire('amplitude', 0, 'w2'))
+        self.assertTrue(sharding.acquire('amplitude', 1, 'w2'))
+
+        ShardLease.objects.filter(shard=0).update(expires_at=now() - datetime.timedelta(seconds=1))
+        self.assertTrue(sharding.acquire('amplitude', 0, 'w2'))
+        sharding.release('amplitude', 0, 'w2')
+        self.assertTrue(sharding.acquire('amplitude', 0, 'w1'))
+
+    def test_scheduled_runs_are_sharded(self):
+        tasks = []
+        with mock.patch.object(event, 'DAD_EVENT_TYPES', [], create=True):
+            with override_settings(DAD_RUN_TASK=tasks.append, DAD_SHARD_COUNT=4):
+                event.EventsDispatcher().schedule_process_events()
+            with override_settings(DAD_RUN_TASK=tasks.append, DAD_SHARD_COUNT=0):
+                event.EventsDispatcher().schedule_process_events()
+        sharded, unsharded = tasks
+        self.assertEqual(sharded.func.__name__, 'process_event_queue_sharded')
+        # scheduled runs clean old events as unsharded ones do
+        self.assertEqual((sharded.args, sharded.keywords), ((4,), {'clean': True}))
+        self.assertEqual(unsharded.__name__, 'process_event_queue')
+
+
+class AdminSearchTest(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.model_admin = admin.EventAdmin(EventToDispatch, site)
+        self.request = RequestFactory().get('/')
+        user = get_user_model().objects.create(username='ann', email='Ann@Example.com')
+        self.event = create_event(user_id=user.pk, event_type='SIGNUP')
+        self.other = create_event(user_id=user.pk + 1, event_type='APP_LOADED')
+
+    def search(self, term):
+        queryset, _ = self.model_admin.get_search_results(self.request, EventToDispatch.objects.all(), term)
+        return set(queryset)
+
+    def test_prefix_search(self):
+        self.assertEqual(self.search(str(self.other.pk)), {self.other})
+        self.assertEqual(self.search('ann@example'), {self.event})
+        self.assertEqual(self.search('SIGN'), {self.event})
+
+    @override_settings(DAD_ADMIN_SEARCH_MODE='exact')
+    def test_exact_search(self):
+        self.assertEqual(self.search('ann@example'), set())
+        self.assertEqual(self.search('ANN@example.com'), {self.event})
+        self.assertEqual(self.search('APP_LOADED'), {self.other})
+
+
+class BatchControllerTest(SimpleTestCase):
+    def setUp(self):
+        config = dict(batching.DEFAULTS, min=10, max=100, initial=40, target_latency=1.0)
+        self.controller = batching.BatchController('amplitude', config)
+
+    def record(self, events_count, duration=0.1, paused=False, errors=0):
+        stats = batching.BatchStats()
+        stats.paused, stats.errors = paused, errors
+        self.controller.record(self.controller.size, events_count, duration, stats)
+        return self.controller.size
+
+    def test_resizing(self):
+        self.assertEqual(self.controller.start_run(backlog=5), batching.DEFAULTS['time_budget'])
+        self.assertEqual(self.record(40), 60)
+        self.assertEqual(self.record(30), 60)
+        self.assertEqual(self.record(60, duration=2.0), 45)
+        self.assertEqual(self.record(45, errors=10), 33)
+        self.assertEqual(self.record(33, paused=True), 16)
+        self.controller.record_failure()
+        self.assertEqual(self.controller.size, 10)
+
+    def test_catch_up(self):
+        self.assertEqual(self.controller.start_run(backlog=100), batching.DEFAULTS['catchup_time_budget'])
+        self.assertEqual(self.record(40), 80)
+        self.assertEqual(self.record(80), 100)
+
+
+@override_settings(DAD_IDEMPOTENCY_WINDOW=60)
+class IdempotencyTest(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        patcher = mock.patch.object(idempotency, 'recent_keys', idempotency.RecentKeys(10))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_keys_of_windows(self):
+        with mock.patch('time.time', return_value=119.0):
+            key, previous_key = idempotency.make_keys('TEST', 'k')
+        with mock.patch('time.time', return_value=121.0):
+            next_key, next_previous_key = idempotency.make_keys('TEST', 'k')
+        self.assertNotEqual(key, previous_key)
+        self.assertEqual(next_previous_key, key)
+        self.assertNotEqual(idempotency.make_keys('OTHER', 'k'), idempotency.make_keys('TEST', 'k'))
+
+    def test_duplicate_in_recent_keys(self):
+        key, previous_key = idempotency.make_keys('TEST', 'k')
+        self.assertFalse(idempotency.is_duplicate(key, previous_key))
+        idempotency.recent_keys.add(key)
+        self.assertTrue(idempotency.is_duplicate(key, previous_key))
+
+    def test_duplicate_across_window_boundary(self):
+        with mock.patch('time.time', return_value=119.0):
+            key, _ = idempotency.make_keys('TEST', 'k')
+        create_event(idempotency_key=key)
+        with mock.patch('time.time', return_value=121.0):
+            next_key, previous_key = idempotency.make_keys('TEST', 'k')
+        self.assertTrue(idempotency.is_duplicate(next_key, previous_key))
+        with mock.patch('time.time', return_value=181.0):
+            later_key, previous_key = idempotency.make_keys('TEST', 'k')
+        self.assertFalse(idempotency.is_duplicate(later_key, previous_key))
+
+    def test_recent_keys_size(self):
+        recent = idempotency.RecentKeys(2)
+        for key in ('a', 'b', 'c'):
+            recent.add(key)
+        self.assertFalse(recent.seen('a'))
+        self.assertTrue(recent.seen('c'))
+
+
+class SamplingTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_sample_is_kept_per_user(self):
+        event_type = EventType(name='SCROLL', sample_rate=0.5)
+        kept = {user_id for user_id in range(200) if sampling.accept(event_type, user_id, None)}
+        self.assertTrue(20 < len(kept) < 180)
+        self.assertEqual(kept, {user_id for user_id in range(200) if sampling.accept(event_type, user_id, 'd')})
+        self.assertFalse(sampling.accept(EventType(name='SCROLL', sample_rate=0.0), 1, None))
+
+    def test_rate_limit(self):
+        event_type = EventType(name='HEARTBEAT', rate_limit=(2, 60))
+        self.assertEqual([sampling.accept(event_type, 1, None) for _ in range(3)], [True, True, False])
+        self.assertTrue(sampling.accept(event_type, 2, None))
+        # anonymous events are limited by device
+        self.assertEqual([sampling.accept(event_type, None, 'd1') for _ in range(3)], [True, True, False])
+        self.assertTrue(sampling.accept(event_type, None, None))
+
+
+class RollupTest(TestCase):
+    databases = '__all__'
+
+    def test_collapse_into_unsent_event(self):
+        key = rollup.make_key('SCROLL', 'u:1', {'page': 'a'})
+        self.assertNotEqual(key, rollup.make_key('SCROLL', 'u:1', {'page': 'b'}))
+        self.assertIsNone(rollup.collapse(key, 60))
+
+        event = create_event(rollup_key=key, send_amplitude=True, event_properties=rollup.init_properties({}))
+        self.assertEqual(rollup.collapse(key, 60), event)
+        event.refresh_from_db()
+        self.assertEqual(event.event_properties[rollup.COUNT_PROPERTY], 2)
+
+        EventToDispatch.objects.filter(pk=event.pk).update(timestamp=now() - datetime.timedelta(seconds=120))
+        self.assertIsNone(rollup.collapse(key, 60))
+
+    def test_sent_event_is_not_collapsed(self):
+        key = rollup.make_key('SCROLL', 'u:1', {})
+        create_event(rollup_key=key, send_amplitude=True, sent_amplitude=now())
+        self.assertIsNone(rollup.collapse(key, 60))
+
+
+class RegistryTest(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        patcher = mock.patch.object(registry, '_backends', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(DAD_BACKENDS={'ga4': None, 'intercom': 'analytics_dispatcher.clients.intercom.IntercomBackend'})
+    def test_backends(self):
+        # MIXPANEL_TOKEN is not set
+        self.assertEqual(sorted(registry.get_backends()), ['amplitude', 'intercom', 'user_dot_com'])
+        with override_settings(DAD_BACKENDS={'segment': None}):
+            self.assertRaises(ImproperlyConfigured, registry.get_backend_paths)
+
+    @override_settings(DAD_BACKENDS={'ga4': None})
+    def test_events_of_disabled_destinations_are_closed(self):
+        event = create_event(send_amplitude=True, send_mix_panel=True, send_ga4=True)
+        self.assertEqual(registry.mark_disabled(), 2)
+        event.refresh_from_db()
+        self.assertEqual((event.sent_amplitude, event.status_amplitude), (None, None))
+        self.assertEqual((event.status_mix_panel, event.status_ga4), (DeliveryStatus.DISABLED, DeliveryStatus.DISABLED))
+        self.assertIsNotNone(event.sent_ga4)
+        self.assertEqual(registry.mark_disabled(), 0)
+
+
+class FanoutTest(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+
+    def test_one_scan_for_all_destinations(self):
+        events = [create_event(send_amplitude=True, send_ga4=True), create_event(send_amplitude=True),
+                  create_event(send_ga4=True, sent_ga4=now())]
+        amplitude, ga4 = FakeBackend('amplitude'), FakeBackend('ga4', status=None)
+        fanout_pass = fanout.Fanout({'amplitude': amplitude, 'ga4': ga4})
+        self.assertEqual(set(fanout_pass.pending_events()), set(events[:2]))
+
+        stats = batching.BatchStats()
+        self.assertEqual(fanout_pass.process_batch(number=10, stats=stats), 2)
+        self.assertEqual(amplitude.delivered, [events[0].pk, events[1].pk])
+        # a failed destination is skipped for the rest of the run, its events stay pending
+        self.assertEqual(fanout_pass.active(), ['amplitude'])
+        self.assertEqual((stats.errors, stats.paused), (1, False))
+        self.assertEqual(set(EventToDispatch.objects.filter(status_amplitude=DeliveryStatus.OK)), set(events[:2]))
+        self.assertEqual(list(fanout.pending_events(['ga4'])), [events[0]])
+        self.assertEqual(fanout_pass.process_batch(number=10), 0)
+
+
+class UserSnapshotTest(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        users.user_cache.clear()
+        self.addCleanup(users.user_cache.clear)
+        self.user = get_user_model().objects.create(username='ann', email='ann@example.com')
+
+    def test_snapshot_by_id_is_cached(self):
+        with self.assertNumQueries(1):
+            snapshot = users.get_snapshot(user_id=self.user.pk)
+            self.assertIs(users.get_snapshot(user_id=self.user.pk), snapshot)
+        self.assertEqual((snapshot.pk, snapshot.email), (self.user.pk, 'ann@example.com'))
+        self.assertEqual(str(snapshot), 'ann@example.com')
+        self.assertIsNone(snapshot.timestamp_joined)
+        self.assertRaises(AttributeError, getattr, snapshot, 'password')
+        self.assertRaises(get_user_model().DoesNotExist, users.get_snapshot, user_id=self.user.pk + 1)
+
+    def test_event_keeps_user_after_deletion(self):
+        event = create_event(user_id=self.user.pk, user_snapshot=users.from_user(self.user))
+        self.user.delete()
+        event = EventToDispatch.objects.get(pk=event.pk)
+        self.assertEqual(event.get_user().email, 'ann@example.com')
+        self.assertIsNone(create_event(user_id=self.user.pk).get_user())
+
+
+class InstantSendTest(SimpleTestCase):
+    def test_executor_is_bounded(self):
+        executor = instant.BoundedExecutor(workers=1, queue_size=1)
+        release, done = threading.Event(), []
+        self.assertTrue(executor.submit(release.wait))
+        self.assertTrue(executor.submit(done.append, 1))
+        self.assertFalse(executor.submit(done.append, 2))
+        release.set()
+        executor._executor.shutdown(wait=True)
+        self.assertEqual(done, [1])
+
+    @override_settings(DAD_INSTANT_SEND_WORKERS=0)
+    def test_disabled(self):
+        self.assertIsNone(instant.get_executor())
+        self.assertFalse(instant.submit(print))
+
+
+class RequestContextTest(SimpleTestCase):
+    def test_context_is_built_once_per_request(self):
+        request = RequestFactory().get('/', HTTP_USER_AGENT='Mozilla/5.0 (iPhone; CPU iPhone OS 16_1 like Mac OS X)',
+                                       REMOTE_ADDR='8.8.8.8')
+        request.device_id = 'd1'
+        with mock.patch.object(analytics_context, 'build', wraps=analytics_context.build) as build:
+            context = analytics_context.get_context(request)
+            self.assertIs(analytics_context.get_context(request), context)
+        build.assert_called_once_with(request)
+        self.assertEqual(context.device_id, 'd1')
+        self.assertEqual((context.session_data['ip'], context.session_data['os_name']), ('8.8.8.8', 'iOS'))
+        with self.assertRaises(TypeError):
+            context.session_data['ip'] = None
+
+
+class ExportTest(TestCase):
+    databases = '__all__'
+
+    def test_export_ndjson(self):
+        events = [create_event(event_type=event_type, event_properties={'n': n})
+                  for n, event_type in enumerate(['SIGNUP', 'APP_LOADED', 'SIGNUP'])]
+        queryset = export.filter_events(event_types=['SIGNUP'])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'events.ndjson.gz')
+            self.assertEqual(export.export(queryset, path), 2)
+            with gzip.open(path, 'rt') as f:
+                rows = [json.loads(line) for line in f]
+        self.assertEqual([(row['id'], row['event_properties']) for row in rows],
+                         [(events[0].pk, {'n': 0}), (events[2].pk, {'n': 2})])
+        self.assertEqual(rows[0]['timestamp'], events[0].timestamp.isoformat())
+
+    def test_split_pk_range(self):
+        first = create_event().pk
+        for _ in range(4):
+            last = create_event().pk
+        self.assertEqual(export.split_pk_range(EventToDispatch.objects.all(), 2),
+                         [(first, first + 2), (first + 3, last)])
+        self.assertEqual(export.split_pk_range(EventToDispatch.objects.none(), 2), [])
+        self.assertEqual(export.part_path('/tmp/events.ndjson.gz', 1), '/tmp/events-001.ndjson.gz')
+
+
+class RequeueTest(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        sent = now()
+        self.events = {
+            status: create_event(send_amplitude=True, sent_amplitude=sent, status_amplitude=status)
+            for status in DeliveryStatus
+        }
+        self.not_sent = create_event(send_ga4=True)
+
+    def test_filter_events(self):
+        self.assertEqual(set(requeue.filter_events('amplitude')), set(self.events.values()))
+        self.assertEqual(set(requeue.filter_events('amplitude', new_destination=True)),
+                         set(self.events.values()) | {self.not_sent})
+        self.assertEqual(set(requeue.filter_events('amplitude', errors_only=True)),
+                         {self.events[DeliveryStatus.ERROR], self.events[DeliveryStatus.REJECTED]})
+
+    def test_requeue_chunks(self):
+        queryset = requeue.filter_events('amplitude', errors_only=True)
+        first, last = requeue.pk_bounds(EventToDispatch.objects.all())
+        chunks = list(requeue.requeue_chunks(queryset, 'amplitude', first, last, chunk_size=2))
+
+        self.assertEqual([(low, high) for low, high, _ in chunks],
+                         [(low, min(low + 1, last)) for low in range(first, last + 1, 2)])
+        self.assertEqual(sum(count for _, _, count in chunks), 2)
+        self.assertEqual(set(EventToDispatch.objects.filter(pending_q('amplitude'))),
+                         {self.events[DeliveryStatus.ERROR], self.events[DeliveryStatus.REJECTED]})
+        self.assertFalse(EventToDispatch.objects.filter(pending_q('ga4')).exclude(pk=self.not_sent.pk).exists())
+
+    def test_parse_time(self):
+        self.assertEqual(parse_time('2024-03-01T10:00:00+00:00'),
+                         datetime.datetime(2024, 3, 1, 10, tzinfo=datetime.timezone.utc))
+        self.assertEqual(parse_time('2024-03-01').replace(tzinfo=None), datetime.datetime(2024, 3, 1))
+        for value in ('yesterday', '2024-02-30'):
+            self.assertRaises(argparse.ArgumentTypeError, parse_time, value)
+
+
+@override_settings(DAD_CIRCUIT_BREAKER={'amplitude': {'failure_threshold': 2, 'reset_timeout': 60}})
+class CircuitBreakerTest(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.breaker = circuit.get_breaker('amplitude')
+        with mock.patch.object(event, 'DAD_EVENT_TYPES', [], create=True):
+            self.dispatcher = event.EventsDispatcher()
+
+    def half_open(self):
+        cache.set(self.breaker._open_until_key, time.time() - 1, None)
+
+    def test_states(self):
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.acquire(), circuit.CLOSED)
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.acquire(), circuit.OPEN)
+        self.half_open()
+        self.assertEqual(self.breaker.acquire(), circuit.HALF_OPEN)
+        # one probe at a time
+        self.assertEqual(self.breaker.acquire(), circuit.OPEN)
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.acquire(), circuit.CLOSED)
+
+    def test_probe_without_request_does_not_close(self):
+        create_event(send_amplitude=True)
+        self.half_open()
+        backend = FakeBackend('amplitude', status=DeliveryStatus.USER_MISSING)
+        self.assertEqual(self.dispatcher._process_destination('amplitude', backend.process_batch,
+                                                              breaker=self.breaker), 1)
+        self.assertEqual(self.breaker.acquire(), circuit.HALF_OPEN)
+
+    def test_probe_continues_after_skipped_event(self):
+        missing, delivered = create_event(send_amplitude=True), create_event(send_amplitude=True)
+        create_event(send_amplitude=True)
+        self.half_open()
+        backend = FakeBackend('amplitude')
+        statuses = iter([DeliveryStatus.USER_MISSING, DeliveryStatus.OK, DeliveryStatus.OK])
+        backend.deliver = lambda e: _base.set_status(e, 'amplitude', next(statuses))
+        self.assertEqual(self.dispatcher._process_destination('amplitude', backend.process_batch,
+                                                              breaker=self.breaker), 3)
+        self.assertEqual(self.breaker.acquire(), circuit.CLOSED)
+        self.assertEqual(EventToDispatch.objects.get(pk=missing.pk).status_amplitude, DeliveryStatus.USER_MISSING)
+        self.assertEqual(EventToDispatch.objects.get(pk=delivered.pk).status_amplitude, DeliveryStatus.OK)
+
+    def test_fanout_probe_without_request_does_not_close(self):
+        create_event(send_amplitude=True)
+        self.half_open()
+        fanout_pass = fanout.Fanout({'amplitude': FakeBackend('amplitude', status=DeliveryStatus.USER_MISSING)})
+        self.assertEqual(fanout_pass.process_batch(number=10), 1)
+        self.assertEqual(fanout_pass.probes, {'amplitude'})
+        fanout_pass.release_probes()
+        self.assertEqual(self.breaker.acquire(), circuit.HALF_OPEN)
+
+
+@override_settings(USER_DOT_COM_API_KEY='key', USER_DOT_COM_APP='app')
+class UserDotComTest(TestCase):
+    databases = '__all__'
+
+    def test_attributes_failure_keeps_event_sent(self):
+        session = mock.Mock()
+        session.request.side_effect = [mock.Mock(status_code=201, text=''), mock.Mock(status_code=503, text='')]
+        with mock.patch.object(_transport, 'get_session', return_value=session):
+            backend = user_dot_com.UserDotComBackend()
+        event = create_event(send_user_dot_com=True, user_snapshot={'id': 1, 'email': 'ann@example.com'},
+                             user_properties={'plan': 'pro'})
+        self.assertEqual(backend.deliver(event), 'next')
+        self.assertEqual(session.request.call_count, 2)
+        self.assertEqual(event.status_user_dot_com, DeliveryStatus.OK)
+
+
+class SessionsTest(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        for lru in (sessions.ids_cache, sessions.data_cache):
+            lru.clear()
+            self.addCleanup(lru.clear)
+
+    def test_session_data_is_stored_once(self):
+        session_id = sessions.intern({'ip': '1.2.3.4', 'platform': 'web'})
+        self.assertEqual(sessions.intern({'platform': 'web', 'ip': '1.2.3.4'}), session_id)
+        self.assertEqual(SessionInfo.objects.count(), 1)
+        event = create_event(session_id=session_id)
+        self.assertEqual(event.get_session_data(), {'ip': '1.2.3.4', 'platform': 'web'})
+
+    def test_prefetch(self):
+        events = [create_event(session_id=sessions.intern({'n': n})) for n in range(3)]
+        sessions.data_cache.clear()
+        with self.assertNumQueries(1, using=routers.get_database()):
+            sessions.prefetch(events)
+            self.assertEqual([event.get_session_data() for event in events], [{'n': 0}, {'n': 1}, {'n': 2}])
+
+
+class ErrorsFilterTest(TestCase):
+    databases = '__all__'
+
+    def test_only_failures_are_errors(self):
+        sent = now()
+        events = {status: create_event(send_amplitude=True, sent_amplitude=sent, status_amplitude=status)
+                  for status in DeliveryStatus}
+        errors = {events[DeliveryStatus.ERROR], events[DeliveryStatus.REJECTED]}
+        self.assertEqual(set(EventToDispatch.objects.filter(errors_q('amplitude'))), errors)
+        self.assertEqual(set(EventToDispatch.objects.filter(ERRORS_Q)), errors)
+        cache.delete(admin.SUMMARY_CACHE_KEY)
+        self.assertEqual({row['destination']: row['errors'] for row in admin.queue_summary()}['amplitude'], 2)
+
+
+class StatusCodesMigrationTest(TransactionTestCase):
+    """
+    0011-0013 status codes migrations convert text statuses to codes, copy failures into DeliveryError and back.
+    """
+    databases = '__all__'
+    app_label = 'analytics_dispatcher'
+    before = '0010_sessioninfo'
+    after = '0013_status_codes_swap'
+
+    def migrate(self, name: str):
+        connection = connections[routers.get_database()]
+        executor = MigrationExecutor(connection)
+        targets = [(self.app_label, name)]
+        executor.migrate(targets)
+        executor.loader.build_graph()
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        connection = connections[routers.get_database()]
+        latest = MigrationExecutor(connection).loader.graph.leaf_nodes(self.app_label)
+        MigrationExecutor(connection).migrate(latest)
+        super().tearDown()
+
+    def test_forward_and_back(self):
+        apps = self.migrate(self.before)
+        OldEvent = apps.get_model(self.app_label, 'EventToDispatch')
+        sends = {'send_' + destination: destination in ('amplitude', 'intercom') for destination in DESTINATIONS}
+        delivered = OldEvent.objects.create(event_type='TEST', status_amplitude='ok', sent_amplitude=now(),
+                                            status_intercom='error: user missed', sent_intercom=now(), **sends)
+        failed = OldEvent.objects.create(event_type='TEST', status_amplitude='events_with_invalid_fields{"a": 1}',
+                                         sent_amplitude=now(), status_intercom='boom', sent_intercom=now(), **sends)
+        pending = OldEvent.objects.create(event_type='TEST', **sends)
+
+        apps = self.migrate(self.after)
+        Event = apps.get_model(self.app_label, 'EventToDispatch')
+        DeliveryError = apps.get_model(self.app_label, 'DeliveryError')
+        statuses = dict((pk, (amplitude, intercom)) for pk, amplitude, intercom in
+                        Event.objects.values_list('pk', 'status_amplitude', 'status_intercom'))
+        self.assertEqual(statuses[delivered.pk], (DeliveryStatus.OK, DeliveryStatus.USER_MISSING))
+        self.assertEqual(statuses[failed.pk], (DeliveryStatus.REJECTED, DeliveryStatus.ERROR))
+        self.assertEqual(statuses[pending.pk], (None, None))
+        self.assertEqual(
+            sorted(DeliveryError.objects.values_list('event_id', 'destination', 'status', 'message')),
+            [(failed.pk, 'amplitude', DeliveryStatus.REJECTED, 'events_with_invalid_fields{"a": 1}'),
+             (failed.pk, 'intercom', DeliveryStatus.ERROR, 'boom')])
+        self.assertFalse(DeliveryError.objects.filter(created_at__isnull=True).exists())
+
+        apps = self.migrate(self.before)
+        OldEvent = apps.get_model(self.app_label, 'EventToDispatch')
+        statuses = dict((pk, (amplitude, intercom)) for pk, amplitude, intercom in
+                        OldEvent.objects.values_list('pk', 'status_amplitude', 'status_intercom'))
+        self.assertEqual(statuses[delivered.pk], ('ok', 'error: user missed'))
+        self.assertEqual(statuses[failed.pk], ('events_with_invalid_fields{"a": 1}', 'boom'))
+        self.assertEqual(statuses[pending.pk], (None, None))
+
+
+@override_settings(DAD_DATABASE='analytics')
+class RouterTest(SimpleTestCase):
+    def test_routes(self):
+        router = routers.AnalyticsRouter()
+        User = get_user_model()
+        self.assertEqual(router.db_for_read(EventToDispatch), 'analytics')
+        self.assertEqual(router.db_for_write(SessionInfo), 'analytics')
+        self.assertIsNone(router.db_for_read(User))
+        # users of events are read from the default database
+        self.assertEqual(router.db_for_read(User, instance=EventToDispatch()), 'default')
+        self.assertTrue(router.allow_migrate('analytics', routers.APP_LABEL))
+        self.assertFalse(router.allow_migrate('default', routers.APP_LABEL))
+        self.assertIsNone(router.allow_migrate('analytics', 'auth'))
+        self.assertTrue(router.allow_relation(EventToDispatch(), User()))
+
+
+@override_settings(EVENT_TYPES=[])
+class LeasingTest(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.events = [create_event(send_amplitude=True, send_ga4=True) for _ in range(3)]
+
+    def test_claim_skips_leased_events(self):
+        token, events = leasing.claim(EventToDispatch.objects.filter(pending_q('amplitude')), 'amplitude', 2)
+        self.assertEqual(len(events), 2)
+        self.assertEqual(EventLease.objects.filter(worker_id=token).count(), 2)
+
+        _, others = leasing.claim(EventToDispatch.objects.filter(pending_q('amplitude')), 'amplitude', 10)
+        self.assertEqual([event.pk for event in others],
+                         [event.pk for event in self.events if event.pk not in {e.pk for e in events}])
+
+        # leases of other destinations don't conflict
+        _, ga4_events = leasing.claim(EventToDispatch.objects.filter(pending_q('ga4')), 'ga4', 10,
+                                      conflicting=('ga4', leasing.FANOUT))
+        self.assertEqual(len(ga4_events), 3)
+
+    def test_expired_leases_are_claimed_again(self):
+        token, events = leasing.claim(EventToDispatch.objects.all(), 'amplitude', 10)
+        self.assertEqual(len(events), 3)
+        EventLease.objects.filter(worker_id=token).update(expires_at=now() - datetime.timedelta(seconds=1))
+
+        new_token, events = leasing.claim(EventToDispatch.objects.all(), 'amplitude', 10)
+        self.assertEqual(len(events), 3)
+        self.assertFalse(EventLease.objects.filter(worker_id=token).exists())
+        self.assertEqual(EventLease.objects.filter(worker_id=new_token).count(), 3)
+
+    def test_release_saves_statuses_and_drops_leases(self):
+        token, events = leasing.claim(EventToDispatch.objects.all(), 'amplitude', 10)
+        sent = now()
+        for claimed in events:
+            claimed.sent_amplitude, claimed.status_amplitude = sent, DeliveryStatus.OK
+        leasing.release(token, events[:1], ['sent_amplitude', 'status_amplitude'])
+
+        self.assertFalse(EventLease.objects.exists())
+        self.assertEqual(EventToDispatch.objects.filter(pending_q('amplitude')).count(), 2)
+        self.assertEqual(EventToDispatch.objects.get(pk=events[0].pk).status_amplitude, DeliveryStatus.OK)
+
+    def test_cleanup_expired(self):
+        token, _ = leasing.claim(EventToDispatch.objects.all(), 'amplitude', 2)
+        EventLease.objects.filter(worker_id=token).update(expires_at=now() - datetime.timedelta(seconds=1))
+        leasing.claim(EventToDispatch.objects.all(), 'ga4', 10)
+
+        self.assertEqual(leasing.cleanup_expired(), 2)
+        self.assertEqual(EventLease.objects.count(), 3)
+
+
+@override_settings(EVENT_TYPES=[EventType(name='SIGNUP', priority=10), EventType(name='SCROLL')],
+                   DAD_INSTANT_SEND_PRIORITY=50, DAD_PRIORITY_FAIRNESS=0.5)
+class PriorityLanesTest(TestCase):
+    databases = '__all__'
+
+    def test_lanes_include_instant_priority(self):
+        self.assertEqual(leasing.get_lanes(), [50, 10, 0])
+
+    def test_lower_lanes_get_a_fair_share(self):
+        low = [create_event(event_type='SCROLL') for _ in range(3)]
+        instant_event = create_event(event_type='SIGNUP', priority=50)
+        high = [create_event(event_type='SIGNUP', priority=10) for _ in range(3)]
+        with transaction.atomic(using=routers.get_database()):
+            events = leasing.select_events(EventToDispatch.objects.all(), 4)
+        self.assertEqual(events, [instant_event, high[0]] + low[:2])
+
+
+class ReportingTest(TestCase):
+    databases = '__all__'
+
+    def create(self, emitted, delay=None, status=DeliveryStatus.OK):
+        event = create_event(send_amplitude=True, event_type='SIGNUP')
+        sent = None if delay is None else emitted + datetime.timedelta(seconds=delay)
+        EventToDispatch.objects.filter(pk=event.pk).update(timestamp=emitted, sent_amplitude=sent,
+                                                           status_amplitude=status if sent else None)
+
+    def test_latency_and_backlog(self):
+        since = now().replace(microsecond=0) - datetime.timedelta(hours=1)
+        until = since + datetime.timedelta(minutes=30)
+        self.create(since, 3)
+        self.create(since, 100)
+        self.create(since, 2, status=DeliveryStatus.ERROR)
+        self.create(since + datetime.timedelta(minutes=10))
+
+        [row] = reporting.latency('amplitude', since, until)
+        self.assertEqual((row['event_type'], row['count']), ('SIGNUP', 2))
+        if not reporting.has_percentiles(EventToDispatch.objects.all()):
+            self.assertEqual((row['p50'], row['p95']), (5, 300))
+        self.assertEqual([count for _, count in reporting.backlog('amplitude', since, until, points=3)], [3, 1, 1])
+
+
+class SchemaTest(SimpleTestCase):
+    def setUp(self):
+        self.event_type = EventType(name='PURCHASE', schema={
+            'event_properties': {'amount': (int, float), 'plan': str, 'coupon': schemas.optional(str)},
+            'user_properties': {'tags': schemas.optional(list)}})
+
+    def test_validate(self):
+        schema = schemas.compile_event_types([self.event_type, EventType(name='SCROLL')])['PURCHASE']
+        self.assertEqual(schema.validate({'amount': 10, 'plan': 'pro'}, {'email': 'a'}), [])
+        self.assertEqual(schema.validate({'amount': True, 'coupon': 1}, {'tags': 'a'}), [
+            'event_properties.amount must be int or float', 'event_properties.plan is required',
+            'event_properties.coupon must be str', 'user_properties.tags must be list'])
+        self.assertEqual(schema.validate([], {}), ['event_properties must be an object'])
+
+    def test_payloads(self):
+        schema = schemas.CompiledSchema(self.event_type)
+        built = schema.build_payloads({'amount': 10}, {'email': 'a', 'tags': ['x', 'y']}, ['amplitude', 'intercom'])
+        self.assertEqual(built, {'intercom': {'event_properties': {'amount': 10},
+                                              'user_attributes': {'email': 'a',
+                                                                  'custom_attributes': {'tags': 'x, y'}}}})
+        self.assertIsNone(schema.build_payloads({}, {}, ['amplitude']))
+        self.assertIsNone(schemas.CompiledSchema(self.event_type._replace(rollup_window=60))
+                          .build_payloads({}, {}, ['ga4']))
+
+        event = EventToDispatch(event_properties={'amount': 10}, user_properties={}, payloads=built)
+        self.assertIs(payloads.get_payload(event, 'intercom'), built['intercom'])
+        self.assertEqual(payloads.get_payload(event, 'ga4'), {'params': {'amount': '10'}, 'user_properties': {}})
+
+
+@override_settings(DAD_MAX_EVENT_AGE={'ga4': 3600}, EVENT_TYPES=[EventType(name='SCROLL', max_age=60)])
+class ExpiryTest(TestCase):
+    databases = '__all__'
+
+    def create(self, event_type, age):
+        event = create_event(event_type=event_type, send_ga4=True, send_amplitude=True)
+        EventToDispatch.objects.filter(pk=event.pk).update(timestamp=now() - datetime.timedelta(seconds=age))
+        return event
+
+    def test_expire_stale(self):
+        stale = [self.create('SIGNUP', 7200), self.create('SCROLL', 120)]
+        fresh = [self.create('SIGNUP', 120), self.create('SCROLL', 30)]
+
+        self.assertEqual(expiry.expire_stale('ga4'), 2)
+        self.assertEqual(set(EventToDispatch.objects.filter(status_ga4=DeliveryStatus.EXPIRED)), set(stale))
+        self.assertEqual(set(EventToDispatch.objects.filter(pending_q('ga4'))), set(fresh))
+        # the event type limit applies to destinations without their own
+        self.assertEqual(expiry.expire_stale('amplitude'), 1)
+        self.assertFalse(EventToDispatch.objects.filter(ERRORS_Q).exists())
+        with override_settings(DAD_MAX_EVENT_AGE={}, EVENT_TYPES=[]):
+            self.assertIsNone(expiry.stale_q('ga4', now()))
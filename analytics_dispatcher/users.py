@@ -0,0 +1,119 @@
+import datetime
+import threading
+import time
+import typing as t
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+# user fields copied into `EventToDispatch.user_snapshot`, missing ones are skipped
+DEFAULT_FIELDS = ('id', 'email', 'username', 'first_name', 'last_name', 'timestamp_joined')
+DEFAULT_CACHE_TTL = 60
+DEFAULT_CACHE_SIZE = 10000
+
+
+def get_fields() -> t.Tuple[str, ...]:
+    return tuple(getattr(settings, 'DAD_USER_SNAPSHOT_FIELDS', DEFAULT_FIELDS))
+
+
+class UserSnapshot(dict):
+    """
+    User fields captured at emit time, readable as attributes like the user object.
+    Snapshot fields the user model lacks are None.
+    """
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        if name in self:
+            return self[name]
+        if name in get_fields():
+            return None
+        raise AttributeError(name)
+
+    @property
+    def pk(self):
+        return self.get('id')
+
+    def __str__(self):
+        return str(self.get('email') or self.get('username') or self.get('id'))
+
+
+def _value(value):
+    # datetimes are stored as unix timestamps, the format destinations expect for dates like `signed_up_at`
+    if isinstance(value, datetime.datetime):
+        return int(value.timestamp())
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+def make_snapshot(values: dict) -> UserSnapshot:
+    return UserSnapshot((name, _value(value)) for name, value in values.items())
+
+
+class UserCache:
+    """
+    Per-process LRU of user snapshots by id, entries expire after DAD_USER_CACHE_TTL seconds.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id) -> t.Optional[UserSnapshot]:
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is None:
+                return None
+            expires_at, snapshot = item
+            if expires_at < time.monotonic():
+                del self._items[user_id]
+                return None
+            return snapshot
+
+    def add(self, user_id, snapshot: UserSnapshot):
+        ttl = getattr(settings, 'DAD_USER_CACHE_TTL', DEFAULT_CACHE_TTL)
+        with self._lock:
+            self._items[user_id] = (time.monotonic() + ttl, snapshot)
+            self._items.move_to_end(user_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+user_cache = UserCache(getattr(settings, 'DAD_USER_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+
+
+def from_user(user) -> UserSnapshot:
+    snapshot = make_snapshot({name: getattr(user, name) for name in get_fields() if hasattr(user, name)})
+    snapshot.setdefault('id', user.pk)
+    user_cache.add(user.pk, snapshot)
+    return snapshot
+
+
+def get_snapshot(user=None, user_id=None) -> t.Optional[UserSnapshot]:
+    """
+    Snapshot of `user`, or of the user with `user_id` taken from the cache or loaded with one query.
+    Raises `User.DoesNotExist` for an unknown `user_id`.
+    """
+    if user is not None:
+        return from_user(user)
+    if user_id is None:
+        return None
+    snapshot = user_cache.get(user_id)
+    if snapshot is not None:
+        return snapshot
+    User = get_user_model()
+    field_names = {field.name for field in User._meta.concrete_fields}
+    values = User.objects.filter(pk=user_id).values(*[name for name in get_fields() if name in field_names]).first()
+    if values is None:
+        raise User.DoesNotExist(f'User {user_id} does not exist')
+    snapshot = make_snapshot(values)
+    snapshot.setdefault('id', user_id)
+    user_cache.add(user_id, snapshot)
+    return snapshot
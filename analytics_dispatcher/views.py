@@ -3,7 +3,7 @@ import logging
 
 from django import http
 
-from . import event
+from . import event, schemas, serialization
 
 logger = logging.getLogger(__name__)
 
@@ -19,14 +19,23 @@ def track(request: http.HttpRequest) -> http.HttpResponse:
         event_type = data['event_type']
     except KeyError:
         return http.HttpResponseBadRequest('No event_type', content_type='text/plain')
-    logger.info('got analytics event from client-side, data: %r', data)
+    serialization.log_payload(logger, logging.INFO, 'got analytics event from client-side, data: %r', data)
 
     properties = data.get('event_properties')
 
-    event.emit(event_type, request,
-               event_properties=properties or {},
-               user_properties=data.get('user_properties') or {}
-               )
+    idempotency_key = data.get('idempotency_key') or request.headers.get('Idempotency-Key')
+    if idempotency_key is not None and not isinstance(idempotency_key, str):
+        return http.HttpResponseBadRequest('Bad idempotency_key', content_type='text/plain')
+
+    try:
+        event.emit(event_type, request,
+                   event_properties=properties or {},
+                   user_properties=data.get('user_properties') or {},
+                   idempotency_key=idempotency_key,
+                   raise_invalid=True,
+                   )
+    except schemas.InvalidEvent as e:
+        return http.HttpResponseBadRequest('; '.join(e.errors), content_type='text/plain')
     return http.HttpResponse('OK', content_type='text/plain')
 
 
@@ -17,6 +17,7 @@ setup(
     include_package_data=True,
     install_requires=['django>=3.2', 'requests', 'django-ipware', 'ua-parser',
                       'django-admin-list-filter-dropdown', 'mixpanel'],
+    extras_require={'orjson': ['orjson'], 'parquet': ['pyarrow']},
     zip_safe=False,
     classifiers=[
         'Development Status :: 4 - Beta',